@@ -0,0 +1,171 @@
+""" administrator/aggregation.py
+
+Award counts by date period for reports. Any filtered AwardEvent queryset
+is counted per day, month or year in one GROUP BY query; weeks and
+quarters, which Django has no database function for, are folded from days
+and months in Python. Periods without awards are filled in with zeros,
+and long ranges are counted by coarser periods to bound the rows.
+"""
+
+import json
+from datetime import date, timedelta
+from django.db.models import Count
+from django.db.models.functions import TruncMonth, TruncYear
+
+# Periods awards can be counted by
+PERIODS = ('day', 'week', 'month', 'quarter', 'year')
+
+# Period the database groups by for each period
+GROUPED_BY = {
+    'day': 'day',
+    'week': 'day',
+    'month': 'month',
+    'quarter': 'month',
+    'year': 'year',
+}
+
+# Next coarser period, used when a range has too many periods
+COARSER = {
+    'day': 'week',
+    'week': 'month',
+    'month': 'quarter',
+    'quarter': 'year',
+}
+
+# Approximate days per period, for counting the periods in a range
+PERIOD_DAYS = {
+    'day': 1,
+    'week': 7,
+    'month': 30.44,
+    'quarter': 91.31,
+    'year': 365.25,
+}
+
+# Most periods filled in by default before counting by a coarser period
+MAX_BUCKETS = 120
+
+def period_start(day, period):
+    """ The first day of the period containing day; weeks start Monday """
+
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'quarter':
+        return date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+    if period == 'year':
+        return date(day.year, 1, 1)
+    raise ValueError('Unknown period {0}'.format(period))
+
+def next_period(start, period):
+    """ The first day of the period after the one starting on start """
+
+    if period == 'day':
+        return start + timedelta(days=1)
+    if period == 'week':
+        return start + timedelta(days=7)
+    if period == 'year':
+        return start.replace(year=start.year + 1)
+    months = 3 if period == 'quarter' else 1
+    month = start.month - 1 + months
+    return date(start.year + month // 12, month % 12 + 1, 1)
+
+def period_label(start, period):
+    """ Default label of the period starting on start """
+
+    if period in ('day', 'week'):
+        return start.isoformat()
+    if period == 'month':
+        return start.strftime('%B %Y')
+    if period == 'quarter':
+        return 'Q{0} {1}'.format((start.month - 1) // 3 + 1, start.year)
+    return str(start.year)
+
+def period_count(start, end, period):
+    """ Approximate number of periods from start to end """
+
+    return int((end - start).days / PERIOD_DAYS[period]) + 1
+
+def grouped_counts(award_events, period):
+    """ Return {date: count} grouped in the database by GROUPED_BY[period]
+
+    Dates are the first day of the grouped period; fold them into the
+    requested period with period_start().
+    """
+
+    grouped_by = GROUPED_BY[period]
+    if grouped_by == 'day':
+        rows = award_events.values('dateOfAward')
+        field = 'dateOfAward'
+    else:
+        truncate = TruncMonth if grouped_by == 'month' else TruncYear
+        rows = award_events.\
+            annotate(period=truncate('dateOfAward')).\
+            values('period')
+        field = 'period'
+
+    # Cleared ordering keeps ordering columns out of the GROUP BY
+    return {
+        row[field]: row['num_awards']
+        for row in rows.annotate(num_awards=Count('id')).order_by()
+    }
+
+class DateBuckets():
+    """ Award counts per period, in date order with gaps filled
+
+    Periods run from the one containing start to the one containing end,
+    which default to the first and last dates with awards. If that is more
+    than max_buckets periods, coarser periods are used until it fits, or
+    until counting by year; pass max_buckets=None to keep the period.
+    label turns the first day of a period into its label.
+
+        period: the period counted by
+        rows:   list of (label, count)
+        total:  number of awards counted
+    """
+
+    def __init__(self, award_events, period, start=None, end=None,
+                 label=None, max_buckets=MAX_BUCKETS):
+        if period not in PERIODS:
+            raise ValueError('Unknown period {0}'.format(period))
+
+        grouped = grouped_counts(award_events, period)
+        self.total = sum(grouped.values())
+        self.rows = []
+        if start is None and grouped:
+            start = min(grouped)
+        if end is None and grouped:
+            end = max(grouped)
+        if start is None or end is None:
+            self.period = period
+            return
+
+        # Coarser periods still fold from the grouped counts: days into any
+        # period, months into quarters and years
+        while max_buckets is not None and period in COARSER and \
+                period_count(start, end, period) > max_buckets:
+            period = COARSER[period]
+        self.period = period
+        label = label or (lambda day: period_label(day, period))
+
+        counts = {}
+        for day, count in grouped.items():
+            key = period_start(day, period)
+            counts[key] = counts.get(key, 0) + count
+
+        current = period_start(start, period)
+        while current <= end:
+            self.rows.append((label(current), counts.get(current, 0)))
+            current = next_period(current, period)
+
+    def chart_data(self, empty_label):
+        """ JSON array for Google Chart; a zero row if there are no rows """
+
+        chart_array = [['Category', 'Count']]
+        chart_array.extend([row_label, count] for row_label, count in self.rows)
+        if not self.rows:
+            # Provide default 0 value to prevent chart error on no awards
+            chart_array.append([empty_label, 0])
+        return json.dumps(chart_array)
@@ -134,4 +134,19 @@ class ReportFilterForm(forms.Form):
     to_dept = forms.ChoiceField(label='Department', choices=dept_choices)
     to_location = forms.ChoiceField(label='Location', choices=loc_choices)
     from_date = forms.DateField(label='Awarded Between', required=False)
-    to_date = forms.DateField(label='and', required=False)
\ No newline at end of file
+    to_date = forms.DateField(label='and', required=False)
+
+class ImportFileForm(forms.Form):
+    """ Upload a CSV or JSON file for a bulk import """
+
+    file = forms.FileField(
+        label='CSV or JSON file',
+        help_text='CSV files need a header row naming the columns')
+
+    def clean_file(self):
+        """ Accept only .csv and .json files """
+
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.csv', '.json')):
+            raise forms.ValidationError('File must be .csv or .json')
+        return upload
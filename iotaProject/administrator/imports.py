@@ -0,0 +1,317 @@
+""" administrator/imports.py
+
+Bulk imports from CSV or JSON. Every row is validated first, against lookup
+tables loaded with a few queries; if any row is invalid nothing is imported
+and the errors are reported by row number. Valid imports are inserted in
+batches inside one transaction.
+"""
+
+import io
+import csv
+import json
+import multiprocessing
+from django.db import transaction
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.db.models.functions import Upper
+from django.utils.dateparse import parse_date
+from teamiota.models import NormalUser, Award, AwardEvent, Department, Location
+from teamiota import jobs
+
+# Rows inserted per INSERT statement
+BATCH_SIZE = 1000
+
+# Values per IN (...) lookup, below SQLite's limit on query parameters
+LOOKUP_CHUNK = 500
+
+# Columns of an award import
+AWARD_COLUMNS = ('awarder', 'awardee', 'awardType', 'dateOfAward')
+
+# Required and optional columns of a user import
+USER_COLUMNS = ('username', 'email', 'password', 'department', 'location')
+OPTIONAL_USER_COLUMNS = ('first_name', 'last_name', 'is_admin')
+
+# Values of is_admin read as true
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+# Passwords hashed per task sent to a hashing process
+HASH_CHUNK = 64
+
+class ImportFailed(Exception):
+    """ An import with invalid rows; errors lists (row number, message)
+
+    Data rows are numbered from 1, not counting a CSV header; problems
+    with the whole file are reported as row 0.
+    """
+
+    def __init__(self, errors):
+        super(ImportFailed, self).__init__(
+            '{0} invalid rows'.format(len(errors)))
+        self.errors = errors
+
+def read_rows(src, name):
+    """ Parse an uploaded .csv or .json file into a list of dicts
+
+    CSV files need a header row; JSON files hold a list of objects.
+    """
+
+    text = src.read()
+    if isinstance(text, bytes):
+        text = text.decode('utf-8-sig')
+    if name.lower().endswith('.json'):
+        rows = json.loads(text)
+        if not isinstance(rows, list) or \
+                not all(isinstance(row, dict) for row in rows):
+            raise ImportFailed([(0, 'JSON imports must be a list of objects')])
+        return rows
+    return list(csv.DictReader(io.StringIO(text)))
+
+def chunks(values, size=LOOKUP_CHUNK):
+    """ Split a list into lists of at most size values """
+
+    values = list(values)
+    return [values[start:start + size]
+            for start in range(0, len(values), size)]
+
+def normal_users_by_email(emails):
+    """ Return {upper-cased email: NormalUser} for these emails
+
+    Emails match case-insensitively, like logins; of users sharing an email
+    the one with the lowest id, who is the one that can log in, is used.
+    """
+
+    found = {}
+    for chunk in chunks({email.upper() for email in emails}):
+        for normal_user in NormalUser.objects.\
+                annotate(upper_email=Upper('user__email')).\
+                filter(upper_email__in=chunk).\
+                select_related('user').\
+                order_by('-user_id'):
+            found[normal_user.upper_email] = normal_user
+    return found
+
+def value(row, column):
+    """ A row's value for a column as a stripped string """
+
+    cell = row.get(column)
+    return '' if cell is None else str(cell).strip()
+
+def missing_columns(rows, columns):
+    """ Return the required columns absent from the first row """
+
+    if not rows:
+        return []
+    return [column for column in columns if column not in rows[0]]
+
+def validate_awards(rows):
+    """ Build unsaved AwardEvents from award rows
+
+    Each row names the awarder and awardee by email, the Award by its
+    awardType and the date as YYYY-MM-DD. Raises ImportFailed listing
+    every invalid row.
+    """
+
+    missing = missing_columns(rows, AWARD_COLUMNS)
+    if missing:
+        raise ImportFailed([(0, 'Missing columns: ' + ', '.join(missing))])
+
+    users = normal_users_by_email(
+        [value(row, 'awarder') for row in rows] +
+        [value(row, 'awardee') for row in rows])
+    award_types = {award.awardType: award for award in Award.objects.all()}
+
+    award_events, errors = [], []
+    for number, row in enumerate(rows, 1):
+        awarder = users.get(value(row, 'awarder').upper())
+        awardee = users.get(value(row, 'awardee').upper())
+        award_type = award_types.get(value(row, 'awardType'))
+        try:
+            award_date = parse_date(value(row, 'dateOfAward'))
+        except ValueError:
+            award_date = None
+
+        problems = []
+        if awarder is None:
+            problems.append(
+                'unknown awarder {0}'.format(value(row, 'awarder')))
+        if awardee is None:
+            problems.append(
+                'unknown awardee {0}'.format(value(row, 'awardee')))
+        elif awardee.isAdmin:
+            problems.append('administrators cannot receive awards')
+        if award_type is None:
+            problems.append(
+                'unknown award type {0}'.format(value(row, 'awardType')))
+        if award_date is None:
+            problems.append(
+                'invalid date {0}'.format(value(row, 'dateOfAward')))
+
+        if problems:
+            errors.append((number, '; '.join(problems)))
+        else:
+            award_events.append(AwardEvent(
+                awarder=awarder,
+                awardee=awardee,
+                awardType=award_type,
+                dateOfAward=award_date))
+
+    if errors:
+        raise ImportFailed(errors)
+    return award_events
+
+def import_awards(rows, batch_size=BATCH_SIZE):
+    """ Validate award rows, insert them and queue their certificates
+
+    Returns the number of awards imported.
+    """
+
+    award_events = validate_awards(rows)
+    with transaction.atomic():
+        jobs.enqueue_many(award_events, batch_size)
+    return len(award_events)
+
+def validate_users(rows):
+    """ Build unsaved (User, NormalUser) pairs from user rows
+
+    Each row has a username, email, password and the department and
+    location by name, optionally first_name, last_name and is_admin.
+    Emails, ignoring case, and usernames must be new and unique within the
+    file. Raises
+    ImportFailed listing every invalid row. Passwords are still raw.
+    """
+
+    missing = missing_columns(rows, USER_COLUMNS)
+    if missing:
+        raise ImportFailed([(0, 'Missing columns: ' + ', '.join(missing))])
+
+    # Emails are compared upper-cased, as logins match them
+    emails = [value(row, 'email').upper() for row in rows]
+    usernames = [value(row, 'username') for row in rows]
+    # One lookup of every email, which the UPPER(email) index serves
+    taken_emails = set(
+        User.objects.annotate(upper_email=Upper('email')).
+        filter(upper_email__in=set(emails)).
+        values_list('upper_email', flat=True))
+    taken_usernames = set()
+    for chunk in chunks(set(usernames)):
+        taken_usernames.update(
+            User.objects.filter(username__in=chunk).
+            values_list('username', flat=True))
+    departments = {department.name: department
+                   for department in Department.objects.all()}
+    locations = {location.name: location
+                 for location in Location.objects.all()}
+
+    now = timezone.now()
+    pairs, errors = [], []
+    seen_emails, seen_usernames = set(), set()
+    for number, row in enumerate(rows, 1):
+        email, username = value(row, 'email'), value(row, 'username')
+        department = departments.get(value(row, 'department'))
+        location = locations.get(value(row, 'location'))
+
+        problems = []
+        if not username:
+            problems.append('missing username')
+        elif username in taken_usernames or username in seen_usernames:
+            problems.append('username {0} is already in use'.format(username))
+        if not email or '@' not in email:
+            problems.append('invalid email {0}'.format(email))
+        elif email.upper() in taken_emails or email.upper() in seen_emails:
+            problems.append('email {0} is already in use'.format(email))
+        if not value(row, 'password'):
+            problems.append('missing password')
+        if department is None:
+            problems.append(
+                'unknown department {0}'.format(value(row, 'department')))
+        if location is None:
+            problems.append(
+                'unknown location {0}'.format(value(row, 'location')))
+        seen_emails.add(email.upper())
+        seen_usernames.add(username)
+
+        if problems:
+            errors.append((number, '; '.join(problems)))
+            continue
+
+        user = User(
+            username=username,
+            email=email,
+            password=value(row, 'password'),
+            first_name=value(row, 'first_name'),
+            last_name=value(row, 'last_name'),
+            last_login=now)
+        pairs.append((user, NormalUser(
+            nickname=NormalUser.default_nickname(user),
+            department=department,
+            location=location,
+            isAdmin=value(row, 'is_admin').lower() in TRUE_VALUES)))
+
+    if errors:
+        raise ImportFailed(errors)
+    return pairs
+
+def _hash_passwords(passwords):
+    """ Hash a chunk of raw passwords (runs in a hashing process) """
+
+    return [make_password(password) for password in passwords]
+
+def hash_passwords(passwords, processes=1):
+    """ Hash raw passwords with the default hasher
+
+    With processes other than 1 they are hashed across a pool of forked
+    processes, None meaning one per CPU. Only do that outside web requests,
+    such as in manage.py import_users: forking a server process copies its
+    threads' state and open connections.
+    """
+
+    password_chunks = chunks(passwords, HASH_CHUNK)
+    if processes == 1 or len(password_chunks) <= 1:
+        return _hash_passwords(passwords)
+
+    # Forked children inherit the configured settings
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        context = multiprocessing.get_context()
+    with context.Pool(processes) as pool:
+        hashed = []
+        for chunk in pool.map(_hash_passwords, password_chunks):
+            hashed.extend(chunk)
+    return hashed
+
+def import_users(rows, batch_size=BATCH_SIZE, processes=1):
+    """ Validate user rows, hash their passwords and insert them
+
+    Passwords are hashed in this process unless processes says otherwise,
+    see hash_passwords(). Users are inserted with bulk_create, so no
+    post_save signal creates their NormalUsers one at a time; they are bulk
+    inserted here too.
+    Returns the number of users imported.
+    """
+
+    pairs = validate_users(rows)
+    users = [user for user, _ in pairs]
+    for user, password in zip(users, hash_passwords(
+            [user.password for user in users], processes)):
+        user.password = password
+
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=batch_size)
+
+        # Only PostgreSQL returns the new ids from bulk_create
+        if any(user.pk is None for user in users):
+            ids = {}
+            for chunk in chunks(user.username for user in users):
+                ids.update(User.objects.filter(username__in=chunk).
+                           values_list('username', 'id'))
+            for user in users:
+                user.pk = ids[user.username]
+
+        normal_users = []
+        for user, normal_user in pairs:
+            normal_user.user = user
+            normal_users.append(normal_user)
+        NormalUser.objects.bulk_create(normal_users, batch_size=batch_size)
+    return len(pairs)
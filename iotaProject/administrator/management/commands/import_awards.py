@@ -0,0 +1,32 @@
+""" administrator/management/commands/import_awards.py """
+
+import csv
+from django.core.management.base import BaseCommand, CommandError
+from administrator import imports
+
+class Command(BaseCommand):
+    """ Import awards in bulk and queue their certificates """
+
+    help = ('Import awards from a CSV (with a header row) or JSON file with '
+            'awarder, awardee, awardType and dateOfAward columns')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='.csv or .json file to import')
+        parser.add_argument(
+            '--batch-size', type=int, default=imports.BATCH_SIZE,
+            help='Awards inserted per statement')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as src:
+                rows = imports.read_rows(src, options['path'])
+            imported = imports.import_awards(rows, options['batch_size'])
+        except imports.ImportFailed as failure:
+            for number, message in failure.errors:
+                self.stderr.write('Row {0}: {1}'.format(number, message))
+            raise CommandError('Nothing imported: {0}'.format(failure))
+        except (IOError, ValueError, csv.Error) as error:
+            raise CommandError('Could not read {0}: {1}'.format(
+                options['path'], error))
+
+        self.stdout.write('Imported {0} awards'.format(imported))
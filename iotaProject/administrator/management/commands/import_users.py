@@ -0,0 +1,37 @@
+""" administrator/management/commands/import_users.py """
+
+import csv
+from django.core.management.base import BaseCommand, CommandError
+from administrator import imports
+
+class Command(BaseCommand):
+    """ Create users in bulk """
+
+    help = ('Import users from a CSV or JSON file with username, email, password, '
+            'department and location columns, and optionally first_name, '
+            'last_name and is_admin')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='.csv or .json file to import')
+        parser.add_argument(
+            '--batch-size', type=int, default=imports.BATCH_SIZE,
+            help='Users inserted per statement')
+        parser.add_argument(
+            '--processes', type=int,
+            help='Password hashing processes (default: one per CPU)')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as src:
+                rows = imports.read_rows(src, options['path'])
+            imported = imports.import_users(
+                rows, options['batch_size'], options['processes'])
+        except imports.ImportFailed as failure:
+            for number, message in failure.errors:
+                self.stderr.write('Row {0}: {1}'.format(number, message))
+            raise CommandError('Nothing imported: {0}'.format(failure))
+        except (IOError, ValueError, csv.Error) as error:
+            raise CommandError('Could not read {0}: {1}'.format(
+                options['path'], error))
+
+        self.stdout.write('Imported {0} users'.format(imported))
@@ -5,6 +5,7 @@ from datetime import date
 from calendar import monthrange
 from django.db.models import Count
 from teamiota.models import NormalUser, AwardEvent, Award, Department, Location
+from .aggregation import DateBuckets
 
 # pylint: disable=too-few-public-methods
 class Summary():
@@ -109,33 +110,13 @@ class Report():
             self.report_data = AwardEvent.objects.filter(
                 dateOfAward__gte=start_date, dateOfAward__lte=end_date)
 
-            # Summary = total awards count for month (length of report_data)
-            sum_array = []
-            row = Summary(
-                'Awards in ' + cur_date.strftime('%B'),
-                len(self.report_data))
-            sum_array.append(row)
-            self.summary_data = sum_array
-
-            # Chart = numAwards each day
-            chart_data = (
-                AwardEvent.objects
-                .filter(dateOfAward__gte=start_date, dateOfAward__lte=end_date)
-                .values('dateOfAward').annotate(num_awards=Count('id'))
-                .order_by('dateOfAward')
-                )
-
-            chart_array = []
-            chart_array.append(['Category', 'Count'])
-            if len(chart_data) > 0:
-                for row in chart_data:
-                    chart_array.append(
-                        [row['dateOfAward'].isoformat(),
-                         row['num_awards']])
-            else:
-                # Provide default 0 value to prevent chart error on no awards
-                chart_array.append([cur_date.strftime('%B'), 0])
-            self.chart_data = json.dumps(chart_array)
+            # Summary = total awards count for month; chart = awards each day
+            buckets = DateBuckets(
+                self.report_data, 'day',
+                cur_date.replace(day=1), cur_date.replace(day=cur_range[1]))
+            self.summary_data = [
+                Summary('Awards in ' + cur_date.strftime('%B'), buckets.total)]
+            self.chart_data = buckets.chart_data(cur_date.strftime('%B'))
             self.sort_col = 1
 
         # 5 = Awards This Year
@@ -154,29 +135,15 @@ class Report():
                                    dateOfAward__gte=start_date,
                                    dateOfAward__lte=end_date)
 
-            # Create summary data: count for each month
-            sum_array = []
-            for i in range(12):
-                temp_date = cur_date.replace(month=i+1)
-                temp_range = monthrange(temp_date.year, temp_date.month)
-                temp_start = temp_date.replace(day=1).isoformat()
-                temp_end = temp_date.replace(day=temp_range[1]).isoformat()
-                count = AwardEvent.\
-                        objects.\
-                        filter(
-                            dateOfAward__gte=temp_start,
-                            dateOfAward__lte=temp_end).\
-                        count()
-                row = Summary(temp_date.strftime('%B'), count)
-                sum_array.append(row)
-            self.summary_data = sum_array
-
-            # Create chart data from summary
-            chart_array = []
-            chart_array.append(['Category', 'Count'])
-            for row in self.summary_data:
-                chart_array.append([row.category, row.num_awards])
-            self.chart_data = json.dumps(chart_array)
+            # Create summary and chart data: count for each month
+            buckets = DateBuckets(
+                self.report_data, 'month',
+                cur_date.replace(month=1, day=1),
+                cur_date.replace(month=12, day=31),
+                label=lambda month: month.strftime('%B'))
+            self.summary_data = [
+                Summary(category, count) for category, count in buckets.rows]
+            self.chart_data = buckets.chart_data(str(cur_date.year))
             self.sort_col = 1
 
         # 6 = Awards All Time -> default report, see else
@@ -230,28 +197,11 @@ class Report():
             self.title = "Awards All Time"
             self.report_data = AwardEvent.objects.all()
 
-            # Create summary data: total lifetime awards
-            sum_array = []
-            row = Summary('Lifetime Awards', len(self.report_data))
-            sum_array.append(row)
-            self.summary_data = sum_array
-
-            # Chart = numAwards each day
-            chart_data = AwardEvent.\
-                         objects.\
-                         values('dateOfAward').\
-                         annotate(num_awards=Count('id')).\
-                         order_by('dateOfAward')
-            chart_array = []
-            chart_array.append(['Category', 'Count'])
-            if len(chart_data) > 0:
-                for row in chart_data:
-                    chart_array.append([row['dateOfAward'].isoformat(),
-                                        row['num_awards']])
-            else:
-                # Provide default 0 value to prevent chart error on no awards
-                chart_array.append(['Lifetime', 0])
-            self.chart_data = json.dumps(chart_array)
+            # Summary = total lifetime awards; chart = awards each day, or
+            # each week or longer period for long histories
+            buckets = DateBuckets(self.report_data, 'day')
+            self.summary_data = [Summary('Lifetime Awards', buckets.total)]
+            self.chart_data = buckets.chart_data('Lifetime')
             self.sort_col = 1
 
     # pylint: disable=unused-variable
@@ -290,9 +240,7 @@ class Report():
             result = result.filter(
                 awardee__location=int(filters['to_location']))
 
-        # Replace report and summary data
+        # Replace report and summary data; the custom report has no chart.
+        # The template evaluates report_data anyway, so len() adds no query
         self.report_data = result
-        sum_array = []
-        row = Summary('Filtered Awards', len(self.report_data))
-        sum_array.append(row)
-        self.summary_data = sum_array
+        self.summary_data = [Summary('Filtered Awards', len(self.report_data))]
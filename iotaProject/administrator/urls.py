@@ -26,4 +26,7 @@ urlpatterns = [
     url(r'edit_user/(?P<user_id>[0-9]+)$', views.edit_user),
     url(r'reports/(?P<report_id>[1-9]+)$', views.reports),
     url(r'reports/custom/', views.reports_filter),
+    url(r'metrics/', views.metrics),
+    url(r'import_awards/', views.import_awards),
+    url(r'import_users/', views.import_users),
 ]
@@ -1,27 +1,27 @@
 """ administrator/views.py """
 
+import csv
 from django.shortcuts import render
 from django.contrib.auth import authenticate, login
 from django.http import HttpResponseRedirect
-from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.auth import logout
 from django.utils import timezone
 from teamiota.models import NormalUser
+from teamiota.decorators import admin_required
+from iotaProject import metrics as pipeline_metrics
 from .reports import Report
+from . import imports
 from .forms import *
-from django.contrib.auth.decorators import user_passes_test
 
 
-@login_required()
-@user_passes_test(lambda u: u.normaluser.isAdmin)
+@admin_required
 def admin_account(request):
     """ The main Administrator Page """
 
     return render(request, 'admin_account.html')
 
-@login_required()
-@user_passes_test(lambda u: u.normaluser.isAdmin)
+@admin_required
 def edit(request):
     """ Process email address input from edit.html """
 
@@ -37,8 +37,7 @@ def edit(request):
         except:
             return render(request, 'edit.html', {'noemail': True})
 
-@login_required()
-@user_passes_test(lambda u: u.normaluser.isAdmin)
+@admin_required
 def edit_user(request, user_id):
     """ Handle the submission of the Edit User form """
 
@@ -73,16 +72,14 @@ def edit_user(request, user_id):
               'edit_user_form': edit_user_form,
             })
 
-@login_required()
-@user_passes_test(lambda u: u.normaluser.isAdmin)
+@admin_required
 def list(request):
     """ Page with a table of Users """
 
     users = NormalUser.objects.all()
     return render(request, 'list.html', {'users':users})
 
-@login_required()
-@user_passes_test(lambda u: u.normaluser.isAdmin)
+@admin_required
 def add_user(request):
     """ Add User Page """
 
@@ -131,8 +128,7 @@ def add_user(request):
                       'new_normal_user': new_normal_user
                   })
 
-@login_required()
-@user_passes_test(lambda u: u.normaluser.isAdmin)
+@admin_required
 def delete(request, user_id):
     """ Delete a User """
 
@@ -144,8 +140,7 @@ def delete(request, user_id):
     user.delete()
     return render(request, 'list.html', {'users': NormalUser.objects.all()})
 
-@login_required()
-@user_passes_test(lambda u: u.normaluser.isAdmin)
+@admin_required
 def reports(request, report_id):
     """ Handler for all reports """
 
@@ -158,8 +153,7 @@ def reports(request, report_id):
         'sort' : this_report.sort_col
     })
 
-@login_required()
-@user_passes_test(lambda u: u.normaluser.isAdmin)
+@admin_required
 def reports_filter(request):
     """ Handler for custom reports """
 
@@ -197,6 +191,64 @@ def reports_filter(request):
 
     return render(request, 'report_filters.html', {'form' : form})
 
+def import_rows(request, import_func, context):
+    """ Render the import page, importing an uploaded file on POST """
+
+    if request.method == 'POST':
+        form = ImportFileForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                rows = imports.read_rows(upload, upload.name)
+                context['imported'] = import_func(rows)
+            except imports.ImportFailed as failure:
+                context['errors'] = failure.errors
+            except (ValueError, csv.Error) as error:
+                context['errors'] = [(0, 'Could not read the file: {0}'.
+                                      format(error))]
+    else:
+        form = ImportFileForm()
+
+    context['form'] = form
+    return render(request, 'import.html', context)
+
+@admin_required
+def import_awards(request):
+    """ Import awards in bulk from an uploaded CSV or JSON file """
+
+    return import_rows(request, imports.import_awards, {
+        'title': 'Import Awards',
+        'noun': 'awards',
+        'columns': imports.AWARD_COLUMNS,
+    })
+
+@admin_required
+def import_users(request):
+    """ Create users in bulk from an uploaded CSV or JSON file """
+
+    return import_rows(request, imports.import_users, {
+        'title': 'Import Users',
+        'noun': 'users',
+        'columns': imports.USER_COLUMNS + imports.OPTIONAL_USER_COLUMNS,
+    })
+
+# Bytes at the end of the metrics log summarized by the metrics page
+METRICS_PAGE_BYTES = 4 * 1024 * 1024
+
+@admin_required
+def metrics(request):
+    """ Certificate pipeline timing percentiles from the current metrics log
+
+    The log is written by the web and certificate_worker processes alike.
+    Only its last METRICS_PAGE_BYTES are read, which hold far more than the
+    spans kept per stage.
+    """
+
+    rows = pipeline_metrics.read_log(
+        pipeline_metrics.log_paths(backups=False),
+        max_bytes=METRICS_PAGE_BYTES).summary()
+    return render(request, 'metrics.html', {'rows': rows})
+
 def logout_user(request):
     """ Handle a User logout request """
 
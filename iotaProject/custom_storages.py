@@ -1,14 +1,128 @@
 """ custom_storages.py """
 
 from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils.module_loading import import_string
 from storages.backends.s3boto import S3BotoStorage
+from iotaProject.diskcache import DiskLRUCache
 
-class StaticStorage(S3BotoStorage):
-    """ Assign AWS S3 as default static files storage """
+class StaticS3Storage(S3BotoStorage):
+    """ AWS S3 bucket folder for static files """
 
     location = settings.STATICFILES_LOCATION
 
-class MediaStorage(S3BotoStorage):
-    """ Assign AWS S3 as default media files storage """
+class MediaS3Storage(S3BotoStorage):
+    """ AWS S3 bucket folder for media files
+
+    Files are stored with the Cache-Control of the first MEDIA_CACHE_CONTROL
+    prefix their name starts with, which S3 sends back when serving them.
+    """
 
     location = settings.MEDIAFILES_LOCATION
+
+    def _save_content(self, key, content, headers):
+        # The key name starts with the bucket folder
+        name = key.name[len(self.location):].lstrip('/')
+        for prefix, cache_control in \
+                getattr(settings, 'MEDIA_CACHE_CONTROL', {}).items():
+            if name.startswith(prefix):
+                headers['Cache-Control'] = cache_control
+                break
+        super(MediaS3Storage, self)._save_content(key, content, headers)
+
+class TieredStorage(Storage):
+    """ A local disk tier in front of another storage
+
+    Saves are written through to the backend and kept on disk; reads are
+    served from disk when the file is there and fetched into it otherwise.
+    The disk tier is bounded by a byte budget, evicting least recently read
+    files. Files overwritten from another machine are refetched once their
+    local copy is older than max_age seconds (None trusts local copies).
+
+    Subclasses set tier to read their options from TIERED_STORAGE[tier]:
+    BACKEND (storage class or dotted path), DIR, MAX_BYTES and MAX_AGE.
+    """
+
+    tier = None
+
+    def __init__(self, backend=None, cache_dir=None, max_bytes=None,
+                 max_age=None):
+        options = getattr(settings, 'TIERED_STORAGE', {}).get(self.tier, {})
+        if backend is None:
+            backend = options['BACKEND']
+            if isinstance(backend, str):
+                backend = import_string(backend)
+            backend = backend()
+        self.backend = backend
+        self.max_age = max_age if max_age is not None else \
+            options.get('MAX_AGE')
+        self.cache = DiskLRUCache(
+            cache_dir or options['DIR'],
+            max_bytes or options.get('MAX_BYTES', 256 * 1024 * 1024))
+
+    def _open(self, name, mode='rb'):
+        if set(mode) - set('rb'):
+            # Written through the backend's file object; drop the local copy
+            self.cache.delete(name)
+            return self.backend.open(name, mode)
+
+        cached = self.cache.open(name, self.max_age)
+        if cached is None:
+            with self.backend.open(name, 'rb') as src:
+                self.cache.put(name, src)
+            cached = self.cache.open(name)
+            if cached is None:
+                # Evicted straight away; the budget is smaller than the file
+                return self.backend.open(name, 'rb')
+        return File(cached, name)
+
+    def _save(self, name, content):
+        name = self.backend.save(name, content)
+        try:
+            content.seek(0)
+        except ValueError:
+            # Closed by the backend; the next read fetches it
+            self.cache.delete(name)
+        else:
+            self.cache.put(name, content)
+        return name
+
+    def delete(self, name):
+        self.cache.delete(name)
+        self.backend.delete(name)
+
+    def exists(self, name):
+        cached = self.cache.open(name, self.max_age)
+        if cached is not None:
+            cached.close()
+            return True
+        return self.backend.exists(name)
+
+    def get_available_name(self, name, max_length=None):
+        return self.backend.get_available_name(name, max_length=max_length)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def modified_time(self, name):
+        return self.backend.modified_time(name)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
+
+class StaticStorage(TieredStorage):
+    """ Assign AWS S3 as default static files storage """
+
+    tier = 'static'
+
+class MediaStorage(TieredStorage):
+    """ Assign AWS S3 as default media files storage """
+
+    tier = 'media'
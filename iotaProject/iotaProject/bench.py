@@ -0,0 +1,263 @@
+""" bench.py
+
+Helpers for benchmarking the certificate pipeline
+"""
+
+import os
+import io
+import sys
+import time
+import resource
+import threading
+import traceback
+import multiprocessing
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import Storage
+from django.core.files.storage import default_storage as storage
+from wand.color import Color
+from wand.drawing import Drawing
+from wand.image import Image
+from teamiota.models import NormalUser, Award, AwardEvent
+from iotaProject import certs
+from iotaProject.metrics import percentile
+
+# pdflatex stand-in for stub mode
+STUB_PDFLATEX = [
+    sys.executable,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_pdflatex.py'),
+]
+
+# Storage name of the benchmark awarder's signature
+SIGNATURE_NAME = 'signatures/bench/sig.png'
+
+class InMemoryStorage(Storage):
+    """ Storage keeping files in a dict, for benchmarks without S3 """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode:
+            return _InMemoryFile(self, name)
+        with self._lock:
+            return File(io.BytesIO(self._files[name]), name)
+
+    def _save(self, name, content):
+        content.seek(0)
+        data = content.read()
+        with self._lock:
+            self._files[name] = data if isinstance(data, bytes) else data.encode()
+        return name
+
+    def write(self, name, data):
+        """ Store bytes under a name, replacing any existing file """
+
+        with self._lock:
+            self._files[name] = data
+
+    def exists(self, name):
+        with self._lock:
+            return name in self._files
+
+    def delete(self, name):
+        with self._lock:
+            self._files.pop(name, None)
+
+    def size(self, name):
+        with self._lock:
+            return len(self._files[name])
+
+    def listdir(self, path):
+        prefix = path.rstrip('/') + '/' if path else ''
+        directories, files = set(), set()
+        with self._lock:
+            names = list(self._files)
+        for name in names:
+            if name.startswith(prefix):
+                head, _, tail = name[len(prefix):].partition('/')
+                if tail:
+                    directories.add(head)
+                else:
+                    files.add(head)
+        return sorted(directories), sorted(files)
+
+    def url(self, name):
+        return '/media/' + name
+
+class _InMemoryFile(File):
+    """ Writable file that stores its bytes in an InMemoryStorage on close """
+
+    def __init__(self, memory_storage, name):
+        super(_InMemoryFile, self).__init__(io.BytesIO(), name)
+        self._storage = memory_storage
+
+    def close(self):
+        if not self.file.closed:
+            self._storage.write(self.name, self.file.getvalue())
+        super(_InMemoryFile, self).close()
+
+def _child(func, args, results):
+    """ Child process body for isolated() """
+
+    try:
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        value = func(*args)
+        wall = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # pylint: disable=broad-except
+    except Exception:
+        results.put({'error': traceback.format_exc()})
+        return
+
+    # Ghostscript and pdflatex run as child processes; count their CPU too
+    cpu = sum(
+        (end.ru_utime - begin.ru_utime) + (end.ru_stime - begin.ru_stime)
+        for begin, end in ((before, after), (children_before, children)))
+    result = dict(value or {})
+    result.update({
+        'wall_s': wall,
+        'cpu_s': cpu,
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_kb': after.ru_maxrss,
+        'rss_growth_kb': after.ru_maxrss - before.ru_maxrss,
+        'child_peak_rss_kb': children.ru_maxrss,
+    })
+    results.put(result)
+
+def isolated(func, args=()):
+    """ Run func(*args) in a fresh child process and measure it
+
+    func returns a dict (or None); the result adds wall and CPU seconds and
+    the child's peak RSS, so memory high-water marks of one measurement do
+    not leak into the next.
+    """
+
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        context = multiprocessing.get_context()
+    results = context.Queue()
+    process = context.Process(target=_child, args=(func, args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return result
+
+def _repeat(func, args, repeat):
+    for _ in range(repeat):
+        func(*args)
+
+def measure(func, args=(), repeat=10):
+    """ Time func(*args) repeated in a fresh child process
+
+    Returns per-call wall and CPU milliseconds plus the child's peak RSS.
+    """
+
+    result = isolated(_repeat, (func, args, repeat))
+    result.update({
+        'repeat': repeat,
+        'wall_ms': 1000 * result['wall_s'] / repeat,
+        'cpu_ms': 1000 * result['cpu_s'] / repeat,
+    })
+    return result
+
+def make_signature():
+    """ Return PNG bytes of a 350x100 signature-like image """
+
+    with Image(width=350, height=100, background=Color('white')) as img:
+        with Drawing() as draw:
+            draw.font_size = 48
+            draw.text(20, 70, 'Benchmark')
+            draw(img)
+        img.format = 'png'
+        return img.make_blob()
+
+def make_event():
+    """ Return an unsaved AwardEvent with unsaved related rows
+
+    Certificates built from it with Certificate(event=...) need no database.
+    """
+
+    awardee = NormalUser(
+        user=User(username='awardee', email='awardee@example.com'),
+        nickname='Ada Lovelace')
+    awarder = NormalUser(
+        user=User(username='awarder', email='awarder@example.com'),
+        nickname='Charles Babbage',
+        signatureImage=SIGNATURE_NAME)
+    award = Award(awardType='Employee of the Month', awardTemplate='blue')
+    return AwardEvent(
+        id=1,
+        awarder=awarder,
+        awardee=awardee,
+        awardType=award,
+        dateOfAward=date(2016, 8, 21))
+
+def _operation(name):
+    """ Return a callable running one benchmark operation on an event """
+
+    def path_op(event):
+        with certs.Certificate(event=event) as this_cert:
+            os.remove(getattr(this_cert, name)())
+
+    def email_op(event):
+        with certs.Certificate(event=event) as this_cert:
+            this_cert.email()
+        del mail.outbox[:]
+
+    return email_op if name == 'email' else path_op
+
+OPERATIONS = ('get_thumb', 'get_image', 'get_pdf', 'email')
+
+def run_operation(name, concurrency, iterations):
+    """ Run an operation iterations times on each of concurrency threads
+
+    Runs in a child process from isolated(); returns latency percentiles
+    and throughput.
+    """
+
+    storage.save(SIGNATURE_NAME, ContentFile(make_signature()))
+    event = make_event()
+    operation = _operation(name)
+    mail.outbox = []
+
+    def timed(_):
+        start = time.perf_counter()
+        operation(event)
+        return 1000 * (time.perf_counter() - start)
+
+    try:
+        # Warm up the TeX pool, format and caches outside the measurement
+        operation(event)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = sorted(
+                executor.map(timed, range(concurrency * iterations)))
+        elapsed = time.perf_counter() - start
+    finally:
+        # The child exits without running atexit handlers
+        certs.stop_tex_pool()
+
+    return {
+        'operation': name,
+        'concurrency': concurrency,
+        'operations': len(latencies),
+        'throughput_per_s': len(latencies) / elapsed,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1],
+        },
+    }
@@ -0,0 +1,94 @@
+""" bench_pdflatex.py
+
+Stand-in for pdflatex used by `manage.py benchmark_certificates --tex stub`.
+It accepts the command lines iotaProject.certs runs, reads the LaTeX source
+from stdin and writes a one-page landscape letter PDF with a border, so the
+rest of the pipeline (Wand, storage, email) can be measured without a TeX
+installation. Anchors for compositing are logged at fixed positions.
+"""
+
+import os
+import re
+import sys
+
+# Page size in PostScript points (landscape letter)
+PAGE_WIDTH = 792
+PAGE_HEIGHT = 612
+
+# Anchor positions in points from the bottom-left corner
+ANCHORS = {
+    'name': (396, 330),
+    'date': (396, 250),
+    'signature': (693, 100),
+}
+
+# TeX scaled points per PostScript point
+SP_PER_BP = 65536 * 72.27 / 72
+
+def make_pdf():
+    """ Return bytes of a minimal one-page PDF with a border """
+
+    content = (
+        b'q 3 w 42.5 42.5 707 527 re S Q\n'
+        b'q 1 w 56.7 56.7 678.6 498.6 re S Q\n')
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {0} {1}] '
+        '/Contents 4 0 R >>'.format(PAGE_WIDTH, PAGE_HEIGHT).encode('ascii'),
+        '<< /Length {0} >>\nstream\n'.format(len(content)).encode('ascii') +
+        content + b'endstream',
+    ]
+
+    pdf = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += '{0} 0 obj\n'.format(number).encode('ascii') + body + b'\nendobj\n'
+
+    xref = len(pdf)
+    pdf += 'xref\n0 {0}\n0000000000 65535 f \n'.format(
+        len(objects) + 1).encode('ascii')
+    for offset in offsets:
+        pdf += '{0:010d} 00000 n \n'.format(offset).encode('ascii')
+    pdf += 'trailer\n<< /Size {0} /Root 1 0 R >>\nstartxref\n{1}\n%%EOF\n'.\
+        format(len(objects) + 1, xref).encode('ascii')
+    return pdf
+
+def main(argv):
+    """ Parse pdflatex-style arguments and write the job's outputs """
+
+    folder, job_name, ini = '.', 'texput', False
+    args = iter(argv)
+    for arg in args:
+        if arg == '-output-directory':
+            folder = next(args)
+        elif arg == '-jobname':
+            job_name = next(args)
+        elif arg == '-ini':
+            ini = True
+
+    source = sys.stdin.buffer.read().decode('utf-8', 'replace')
+    path = os.path.join(folder, job_name)
+
+    if ini:
+        with open(path + '.fmt', 'wb') as dest:
+            dest.write(b'bench format\n')
+        return
+
+    log = ['This is a pdflatex stand-in for benchmarks']
+    for name in re.findall(r'\\certanchor\{(\w+)\}', source):
+        if name in ANCHORS:
+            x, y = ANCHORS[name]
+            log.append('CERTANCHOR {0} {1} {2}'.format(
+                name, int(x * SP_PER_BP), int(y * SP_PER_BP)))
+
+    with open(path + '.aux', 'w') as dest:
+        dest.write('\\relax\n')
+    with open(path + '.log', 'w') as dest:
+        dest.write('\n'.join(log) + '\n')
+    with open(path + '.pdf', 'wb') as dest:
+        dest.write(make_pdf())
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
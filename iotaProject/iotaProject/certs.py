@@ -2,36 +2,498 @@
 
 import os
 import re
+import math
+import queue
+import fcntl
+import atexit
+import time
+import hashlib
 import logging
 import shutil
+import threading
+import weakref
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import Popen, PIPE
-from tempfile import mkstemp
+from tempfile import mkstemp, mkdtemp, gettempdir
+from django.conf import settings
 from django.core.files.storage import default_storage as storage
 from django.core.files import File
+from django.core.files.base import ContentFile
 from django.core.mail.message import EmailMessage
 from django.template.loader import render_to_string
 from teamiota.models import AwardEvent
 from wand.image import Image
+from iotaProject import metrics
+from iotaProject.diskcache import DiskLRUCache
+
+# Storage folder for rendered certificates, named by content hash
+CACHE_LOCATION = 'certificates'
+
+# Seconds a render waits for another process's render of the same
+# certificate before rendering it too
+RENDER_LOCK_TIMEOUT = 120
+
+# Render lock files; keys share one of this many files by hash
+RENDER_LOCK_STRIPES = 256
+
+class _Call():
+    """ A render in flight, shared by every thread waiting on the same key """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight():
+    """ Collapse concurrent calls for the same key into a single call
+
+    The first caller for a key runs the function; callers arriving while it
+    is running block and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """ Run func() once for all concurrent callers of key """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as exception:
+            call.error = exception
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+_renders = SingleFlight()
+
+# Name of the certificate jobs run by each TeX worker
+TEX_JOB_NAME = 'award'
+
+# Static certificate preamble, dumped into a precompiled format
+PREAMBLE_TEMPLATE = 'award_preamble.tex'
+
+def pdflatex_command():
+    """ Command line that runs pdflatex (CERTIFICATE_PDFLATEX setting) """
+
+    return list(getattr(settings, 'CERTIFICATE_PDFLATEX', ['pdflatex']))
+
+class TexWorker():
+    """ A scratch directory with a pdflatex process started ahead of time
+
+    pdflatex cannot compile more than one document per process, so each
+    worker keeps the next process already started and waiting on stdin.
+    That only saves starting the executable: pdflatex reads the first line
+    of input before it loads the format, so loading the precompiled
+    preamble format still happens per job. The .aux file is kept between
+    jobs: certificates share one layout, so a worker usually needs a single
+    pass after its first.
+    """
+
+    def __init__(self, folder, fmt=None):
+        self.folder = folder
+        self.fmt = fmt
+        self.process = None
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.__spawn()
+
+    # Helper method for starting the next pdflatex process
+    def __spawn(self):
+        command = pdflatex_command()
+        env = None
+        if self.fmt is not None:
+            fmt_folder, fmt_name = os.path.split(self.fmt)
+            command += ['-fmt', fmt_name]
+            env = dict(os.environ)
+            env['TEXFORMATS'] = fmt_folder + os.pathsep
+        command += [
+            '-output-directory', self.folder,
+            '-jobname', TEX_JOB_NAME,
+        ]
+        self.process = Popen(command, stdin=PIPE, stdout=PIPE, env=env)
+
+    # Helper method for reading a file produced by the last job
+    def __read(self, ext):
+        try:
+            with open(os.path.join(self.folder, TEX_JOB_NAME + ext), 'rb') as src:
+                return src.read()
+        except (IOError, OSError):
+            return None
+
+    def compile(self, latex, log=False):
+        """ Compile LaTeX source bytes and return the PDF bytes
+
+        With log=True, return (PDF bytes, log text) instead.
+        """
+
+        pdf_path = os.path.join(self.folder, TEX_JOB_NAME + '.pdf')
+        try:
+            os.remove(pdf_path)
+        except OSError:
+            pass
+
+        # Run pdflatex until the .aux file settles (at most twice) so the
+        # border is placed correctly
+        for _ in range(2):
+            aux = self.__read('.aux')
+            process = self.process
+            with metrics.span('pdflatex'):
+                process.communicate(latex)
+            self.__spawn()
+            if self.__read('.aux') == aux:
+                break
+
+        pdf = self.__read('.pdf')
+        if pdf is None:
+            raise RuntimeError(
+                'pdflatex failed, see {0}'.format(
+                    os.path.join(self.folder, TEX_JOB_NAME + '.log')))
+        if log:
+            return pdf, (self.__read('.log') or b'').decode('utf-8', 'replace')
+        return pdf
+
+    def stop(self):
+        """ Stop the waiting pdflatex process and remove the scratch directory """
+
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+class TexWorkerPool():
+    """ A fixed number of TeX workers sharing a precompiled preamble format
+
+    Size and location come from the CERTIFICATE_TEX_WORKERS and
+    CERTIFICATE_TEX_DIR settings. Callers block while every worker is busy.
+    """
+
+    def __init__(self, size, folder):
+        self.pid = os.getpid()
+        self.folder = folder
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.__remove_stale_workers()
+        self.fmt = self.__build_format()
+        self._idle = queue.Queue()
+        self._workers = []
+        for i in range(size):
+            worker = TexWorker(
+                os.path.join(folder, 'worker-{0}-{1}'.format(self.pid, i)),
+                self.fmt)
+            self._workers.append(worker)
+            self._idle.put(worker)
+
+    # Helper method for removing the scratch directories of workers whose
+    # process exited without stopping its pool
+    def __remove_stale_workers(self):
+        for name in os.listdir(self.folder):
+            match = re.match(r'^worker-(\d+)-\d+$', name)
+            if match is None or int(match.group(1)) == self.pid:
+                continue
+            try:
+                os.kill(int(match.group(1)), 0)
+            except ProcessLookupError:
+                shutil.rmtree(
+                    os.path.join(self.folder, name), ignore_errors=True)
+            except OSError:
+                # Alive, owned by another user
+                pass
+
+    # Helper method for dumping the preamble into a format file, named by a
+    # hash of the preamble so template changes build a new one
+    def __build_format(self):
+        preamble = render_to_string(PREAMBLE_TEMPLATE).encode('utf-8')
+        name = 'award-' + hashlib.sha1(preamble).hexdigest()[:12]
+        fmt = os.path.join(self.folder, name)
+        if os.path.exists(fmt + '.fmt'):
+            return fmt
+
+        # Build under a private job name and rename into place, so processes
+        # building at the same time never load a partial format
+        job_name = '{0}-{1}'.format(name, os.getpid())
+        process = Popen(
+            pdflatex_command() + [
+                '-ini', '-output-directory', self.folder,
+                '-jobname', job_name, '&pdflatex'],
+            stdin=PIPE,
+            stdout=PIPE
+        )
+        process.communicate(preamble + b'\n\\dump\n')
+        try:
+            os.rename(
+                os.path.join(self.folder, job_name + '.fmt'), fmt + '.fmt')
+        except OSError:
+            logging.getLogger(__name__).error(
+                'Could not build certificate format, compiling without it')
+            return None
+        finally:
+            try:
+                os.remove(os.path.join(self.folder, job_name + '.log'))
+            except OSError:
+                pass
+        return fmt
+
+    def compile(self, latex, log=False):
+        """ Compile LaTeX source bytes on the next idle worker """
+
+        with metrics.span('tex_pool_wait'):
+            worker = self._idle.get()
+        try:
+            return worker.compile(latex, log)
+        finally:
+            self._idle.put(worker)
+
+    def stop(self):
+        """ Stop every worker and remove their scratch directories """
+
+        for worker in self._workers:
+            worker.stop()
+
+_tex_pool = None
+_tex_pool_lock = threading.Lock()
+
+def get_tex_pool():
+    """ Return this process's TeX worker pool, starting it on first use """
+
+    # pylint: disable=global-statement
+    global _tex_pool
+    with _tex_pool_lock:
+        # A forked child must not share its parent's pdflatex processes
+        if _tex_pool is None or _tex_pool.pid != os.getpid():
+            _tex_pool = TexWorkerPool(
+                getattr(settings, 'CERTIFICATE_TEX_WORKERS', 2),
+                getattr(settings, 'CERTIFICATE_TEX_DIR',
+                        os.path.join(gettempdir(), 'iota-tex')))
+        return _tex_pool
+
+@atexit.register
+def stop_tex_pool():
+    """ Stop this process's TeX worker pool; the next render starts a new one """
+
+    # pylint: disable=global-statement
+    global _tex_pool
+    with _tex_pool_lock:
+        if _tex_pool is not None and _tex_pool.pid == os.getpid():
+            _tex_pool.stop()
+        _tex_pool = None
+
+class UploadError(Exception):
+    """ Artifacts that failed to upload; errors maps each name to its exception """
+
+    def __init__(self, errors):
+        super(UploadError, self).__init__('Upload failed: ' + '; '.join(
+            '{0}: {1}'.format(name, error)
+            for name, error in sorted(errors.items())))
+        self.errors = errors
+
+_upload_pool = None
+_upload_pool_pid = None
+_upload_pool_lock = threading.Lock()
+
+def get_upload_pool():
+    """ Return this process's bounded pool of storage upload threads """
+
+    # pylint: disable=global-statement
+    global _upload_pool, _upload_pool_pid
+    with _upload_pool_lock:
+        # A forked child does not inherit its parent's threads
+        if _upload_pool is None or _upload_pool_pid != os.getpid():
+            _upload_pool = ThreadPoolExecutor(
+                getattr(settings, 'CERTIFICATE_UPLOAD_THREADS', 4))
+            _upload_pool_pid = os.getpid()
+        return _upload_pool
+
+def submit_upload(func, tags=None, stage='storage_upload'):
+    """ Run an upload function on the upload pool and return its future """
+
+    def timed():
+        with metrics.span(stage, **(tags or {})):
+            return func()
+
+    return get_upload_pool().submit(timed)
+
+def wait_for_uploads(futures):
+    """ Wait for a {name: future} dict of uploads; return {name: result}
+
+    Raises UploadError naming every upload that failed.
+    """
+
+    results, errors = {}, {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        # pylint: disable=broad-except
+        except Exception as exception:
+            errors[name] = exception
+    if errors:
+        raise UploadError(errors)
+    return results
+
+def upload(artifacts, tags=None):
+    """ Save a {storage name: bytes} dict to storage concurrently
+
+    Names already in storage are left alone.
+    """
+
+    def save(name, content):
+        if not storage.exists(name):
+            storage.save(name, ContentFile(content))
+
+    wait_for_uploads({
+        name: submit_upload(lambda n=name, c=content: save(n, c), tags)
+        for name, content in artifacts.items()
+    })
+
+@contextmanager
+def render_lock(key, timeout=RENDER_LOCK_TIMEOUT):
+    """ Hold the render lock of a certificate key
+
+    The lock is an flock on a file under CERTIFICATE_RENDER_LOCK_DIR, so it
+    is shared by every process on this machine, is only released by its
+    holder and is released by the kernel if the holder dies. Yields True
+    once the lock is held, or False if timeout seconds pass first.
+    """
+
+    folder = getattr(settings, 'CERTIFICATE_RENDER_LOCK_DIR',
+                     os.path.join(gettempdir(), 'iota-render-locks'))
+    os.makedirs(folder, exist_ok=True)
+    stripe = int(hashlib.sha256(key.encode('utf-8')).hexdigest(), 16) % \
+        RENDER_LOCK_STRIPES
+    path = os.path.join(folder, '{0}.lock'.format(stripe))
+
+    with open(path, 'a') as handle:
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.time() >= deadline:
+                    yield False
+                    return
+                time.sleep(0.25)
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+_signature_cache = None
+
+def get_signature_cache():
+    """ Return the local disk cache of awarders' signature images """
+
+    # pylint: disable=global-statement
+    global _signature_cache
+    if _signature_cache is None:
+        _signature_cache = DiskLRUCache(
+            getattr(settings, 'CERTIFICATE_SIGNATURE_CACHE_DIR',
+                    os.path.join(gettempdir(), 'iota-signatures')),
+            getattr(settings, 'CERTIFICATE_SIGNATURE_CACHE_BYTES', 64 << 20))
+    return _signature_cache
+
+def signature_cache_key(name, content_hash):
+    """ Signature cache key of a stored signature image """
+
+    return '{0}@{1}'.format(name, content_hash)
+
+# Thumbnail size shown in the award grid
+THUMB_WIDTH = 165
+THUMB_HEIGHT = 125
+
+# Certificate page size in inches (award.tex is landscape letter)
+PAGE_WIDTH = 11.0
+PAGE_HEIGHT = 8.5
+
+# Resolution of the full-sized certificate image
+IMAGE_RESOLUTION = 300
+
+# Resolution that rasterizes the page at twice the thumbnail size, leaving
+# enough detail for a smooth downscale without decoding a full-sized page
+THUMB_RESOLUTION = int(math.ceil(
+    2 * max(THUMB_WIDTH / PAGE_WIDTH, THUMB_HEIGHT / PAGE_HEIGHT)))
+
+def render_source(context):
+    """ Render award.tex with a context and return LaTeX source bytes """
+
+    latex = render_to_string('award.tex', context)
+
+    # Remove spaces caused by django templating.
+    # Based on example from: http://stackoverflow.com/questions/35085077/\
+    # how-to-properly-set-variables-in-a-latex-template-for-django
+    latex = re.sub(r'\{REPLACE', '{', latex)
+    latex = re.sub(r'REPLACE\}', '}', latex)
+    return latex.encode('utf-8')
+
+def rasterize(pdf_content, resolution, size=None):
+    """ Convert PDF bytes to PNG bytes at a resolution, optionally resized """
+
+    # pylint: disable=line-too-long
+    # Sources:  http://mikelynchgames.com/software-development/using-wand-to-extract-pngs-from-pdfs/
+    #           http://stackoverflow.com/questions/27826854/python-wand-convert-pdf-to-png-disable-transparent-alpha-channel
+    with Image(blob=pdf_content, format='pdf', resolution=resolution) as img:
+        with img.convert('png') as converted:
+            converted.alpha_channel = False
+            if size is not None:
+                converted.resize(*size)
+            return converted.make_blob()
+
+# pylint: disable=too-few-public-methods
+class Rendering():
+    """ Artifacts produced by a single certificate compile """
+
+    def __init__(self, pdf=None, image=None, thumb=None):
+        self.pdf = pdf
+        self.image = image
+        self.thumb = thumb
 
 # pylint: disable=too-many-instance-attributes
 class Certificate():
     """ A certificate (pdf, thumbnail png, or large png) """
 
-    # Constructor takes award Id and pulls info from database to setup instance variables
-    def __init__(self, awardId):
-        event = AwardEvent.objects.get(id=awardId)
-        self.to_name = event.awardee.nickname
-        self.to_email = event.awardee.user.email
-        self.from_name = event.awarder.nickname
-        self.from_signature = None
-        self.award_type = event.awardType.awardType
-        self.award_template = event.awardType.awardTemplate
-
-        # Make a local copy of the signature image
-        with storage.open(event.awarder.signatureImage.name, 'rb+') as src:
-            with open('signature.png', 'wb+') as dest:
-                shutil.copyfileobj(src, dest)
-                self.from_signature = File(dest)
+    # Constructor takes award Id and pulls info from database to setup instance variables.
+    # Pass an AwardEvent already loaded with its related rows as event to skip the lookup.
+    def __init__(self, awardId=None, event=None):
+        with metrics.span('orm', award=awardId):
+            if event is None:
+                event = AwardEvent.objects.get(id=awardId)
+            awardId = event.id
+            self.to_name = event.awardee.nickname
+            self.to_email = event.awardee.user.email
+            self.from_name = event.awarder.nickname
+            self.from_signature = None
+            self.award_type = event.awardType.awardType
+            self.award_template = event.awardType.awardTemplate
+
+        # Tags for this certificate's timing spans
+        self.tags = {'award': awardId, 'award_type': self.award_type}
+
+        # Make a local copy of the signature image in scratch space private
+        # to this certificate, so concurrent renders never share files
+        self.scratch = mkdtemp(prefix='cert_')
+        self._cleanup = weakref.finalize(
+            self, shutil.rmtree, self.scratch, True)
+        with metrics.span('signature_download', **self.tags):
+            self.__copy_signature(event.awarder)
 
         # Extract date info
         award_date = event.dateOfAward
@@ -51,24 +513,52 @@ class Certificate():
         self.month = award_date.strftime("%B")
         self.year = str(award_date.year)
 
-    # Helper method for populating latex template and converting to PDF
-    def __generate_pdf(self):
-        # pdflatex code based on two references:
-        # https://blog.sevenbyte.org/2014/09/23/generating-pdfs-with-django-and-latex.html
-        # http://robvdl.co.nz/blog/post/latex-and-django/
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Remove this certificate's scratch space """
+
+        self._cleanup()
 
+    # Helper method for copying the awarder's signature into scratch space,
+    # from the local signature cache when it holds the current image
+    def __copy_signature(self, awarder):
+        name = awarder.signatureImage.name
+        sig_cache = get_signature_cache()
+        # Signatures uploaded before signatureHash existed are not cached
+        key = signature_cache_key(name, awarder.signatureHash) \
+            if awarder.signatureHash else None
+        cached = sig_cache.open(key) if key else None
+
+        sig_path = os.path.join(self.scratch, 'signature.png')
+        with (cached or storage.open(name, 'rb')) as src:
+            with open(sig_path, 'wb') as dest:
+                shutil.copyfileobj(src, dest)
+                self.from_signature = File(dest)
+
+        if key and cached is None:
+            with open(sig_path, 'rb') as src:
+                sig_cache.put(key, src)
+
+    # Helper method for populating the latex template with instance data
+    def __render_latex(self, sig_path=None, sig_name=None, precompiled=False):
         # Separate signatureImage into path and filename and modify for tex requirements
         # Get path and add trailing /
+        if sig_path is None:
+            sig_path, sig_file = os.path.split(
+                os.path.abspath(self.from_signature.name))
 
-        sig_path, sig_file = os.path.split(self.from_signature.name)
-
-        # Special handling for Windows test environments
-        if os.name == 'nt':
-            sig_path = sig_path.replace('\\', '/')
+            # Special handling for Windows test environments
+            if os.name == 'nt':
+                sig_path = sig_path.replace('\\', '/')
 
-        sig_path += '/'
-        # Get filaname without extension
-        sig_name, ext = os.path.splitext(sig_file)
+            sig_path += '/'
+            # Get filaname without extension
+            sig_name = os.path.splitext(sig_file)[0]
 
         # Render latex award using template and instance data
         context = {
@@ -81,75 +571,80 @@ class Certificate():
             'awardDay' : self.day,
             'awardMonth' : self.month,
             'awardYear' : self.year,
+            'precompiled' : precompiled,
         }
-        latex = render_to_string('award.tex', context)
-
-        # Remove spaces caused by django templating.
-        # Based on example from: http://stackoverflow.com/questions/35085077/\
-        # how-to-properly-set-variables-in-a-latex-template-for-django
-        latex = re.sub(r'\{REPLACE', '{', latex)
-        latex = re.sub(r'REPLACE\}', '}', latex)
-        latex = latex.encode('utf-8')
+        with metrics.span('latex_template', **self.tags):
+            return render_source(context)
 
-        # Setup temp file
-        temp_file, path = mkstemp(prefix="award_", suffix=".pdf")
-
-        # Special handling for Windows test environments
-        if os.name == 'nt':
-            path = path.replace('\\', '/')
+    # Helper method for converting populated latex template to PDF bytes
+    def __generate_pdf(self):
+        pool = get_tex_pool()
+        latex = self.__render_latex(precompiled=pool.fmt is not None)
+        with metrics.tagged(**self.tags):
+            return pool.compile(latex)
 
-        # split path into folder and filename
-        folder, filename = os.path.split(path)
-        # split filename into name and extension (pdflatex uses jobname)
-        job_name, ext = os.path.splitext(filename)
+    def render(self, pdf=True, image=True, thumb=True):
+        """ Compile the certificate once and return the requested artifacts
 
-        # Run pdflatex to generate PDF tempfile, run twice to place border
-        # correctly
-        for _ in range(2):
-            process = Popen(
-                ["pdflatex", "-output-directory", folder, "-jobname", job_name],
-                stdin=PIPE,
-                stdout=PIPE
-            )
-            process.communicate(latex)
+        Returns a Rendering holding PDF bytes, a full-sized PNG and a
+        thumbnail-sized PNG; artifacts that were not requested are None.
 
-        # Clean-up temp files
-        for ext in (".aux", ".log", ".toc", ".lof", ".lot", ".synctex.gz"):
-            try:
-                os.remove(os.path.join(folder, job_name) + ext)
-            except OSError:
-                pass
+        With CERTIFICATE_COMPOSITING enabled, thumbnails (and full-sized
+        images when no PDF is needed) are composited over a cached Award
+        background instead of typeset; see iotaProject.compositing.
+        """
 
-        # Special handling for Windows test environments
-        if os.name == 'nt':
-            # Copy texput.pdf to correct path
-            try:
-                with open(folder + "/texput.pdf", "rb") as src, \
-                     os.fdopen(temp_file, "wb") as dest:
-                    shutil.copyfileobj(src, dest)
+        # Imported here: compositing builds on this module
+        from iotaProject import compositing
 
-            except Exception as exception:
-                print('{0}'.format(exception))
+        composite = getattr(settings, 'CERTIFICATE_COMPOSITING', True)
+        rendering = Rendering()
 
-            try:
-                os.remove(folder + "/texput.pdf")
-
-            except Exception as exception:
-                print('{0}'.format(exception))
-
-            # Clean-up temp files
-            for ext in (".aux", ".log", ".toc", ".lof", ".lot", ".synctex.gz"):
-                try:
-                    os.remove(os.path.join(folder + "/texput") + ext)
-                except Exception as exception:
-                    pass
+        # Generate PDF
+        pdf_content = None
+        if pdf or not composite:
+            pdf_content = self.__generate_pdf()
+            if pdf:
+                rendering.pdf = pdf_content
 
-        # Return generated PDF as path
-        return path
+        # Convert to PNG
+        if image and pdf_content is not None:
+            with metrics.span('rasterize', **self.tags), \
+                 Image(blob=pdf_content, format='pdf',
+                       resolution=IMAGE_RESOLUTION) as img:
+                with img.convert('png') as converted:
+                    converted.alpha_channel = False
+                    rendering.image = converted.make_blob()
+
+                    # Full-sized page is already decoded; downscale it
+                    if thumb:
+                        converted.resize(THUMB_WIDTH, THUMB_HEIGHT)
+                        rendering.thumb = converted.make_blob()
+        elif image:
+            with metrics.span('composite', **self.tags):
+                rendering.image = compositing.composite(self, IMAGE_RESOLUTION)
+
+        # Thumbnail alone only needs a low-resolution raster
+        if thumb and rendering.thumb is None:
+            if composite:
+                with metrics.span('composite', **self.tags):
+                    rendering.thumb = compositing.composite(
+                        self, THUMB_RESOLUTION, (THUMB_WIDTH, THUMB_HEIGHT))
+            else:
+                with metrics.span('rasterize', **self.tags):
+                    rendering.thumb = rasterize(
+                        pdf_content, THUMB_RESOLUTION,
+                        (THUMB_WIDTH, THUMB_HEIGHT))
+
+        return rendering
 
     # Emails certificate to award recipient at their registered email address
-    def email(self):
-        """ Send email to award recipient User email """
+    def email(self, pdf_content=None):
+        """ Send email to award recipient User email
+
+        Pass the PDF bytes from an earlier render() to avoid compiling the
+        certificate again. Errors sending or spooling the email are raised.
+        """
 
         # Setup logger for debugging
         logger = logging.getLogger(__name__)
@@ -165,17 +660,8 @@ class Certificate():
         )
 
         # Generate PDF
-        path = self.__generate_pdf()
-        filename = os.path.split(path)[1]
-
-        # Open file and read contents into variable
-        try:
-            pdf = open(path, mode='rb')
-            pdf_content = pdf.read()
-            pdf.close()
-
-        except OSError as exception:
-            logger.error('OS error: %s ', exception)
+        if pdf_content is None:
+            pdf_content = self.render(image=False, thumb=False).pdf
 
         # Create email with pdf attached
         email = EmailMessage(
@@ -185,93 +671,91 @@ class Certificate():
             to=[self.to_email],
             headers={'Reply-To': 'teamosuiota@gmail.com'}
             )
+        email.attach('certificate.pdf', pdf_content, 'application/pdf')
         try:
-            email.attach(filename, pdf_content, 'application/pdf')
-            email.send()
-
-        except:
-            logger.error('Failed to send email')
+            with metrics.span('email', **self.tags):
+                email.send()
+        except Exception:
+            # Raised so the certificate job is retried
+            logger.error('Failed to send email to %s', self.to_email)
+            raise
+
+    # Helper method for writing rendered bytes to a temp file path
+    @staticmethod
+    def __to_temp_file(content, suffix):
+        temp_file, path = mkstemp(prefix="award_", suffix=suffix)
+        with os.fdopen(temp_file, 'wb') as dest:
+            dest.write(content)
 
-        # Clean-up temp file
-        try:
-            os.remove(path)
+        # Special handling for Windows test environments
+        if os.name == 'nt':
+            path = path.replace('\\', '/')
 
-        except OSError:
-            pass
+        return path
 
     def get_pdf(self):
         """ Return PDF version of certificate """
 
         # Generate PDF and return path
-        return self.__generate_pdf()
+        return self.__to_temp_file(
+            self.render(image=False, thumb=False).pdf, '.pdf')
 
     def get_image(self):
         """ Return full-sized PNG of certificate """
 
-        # Generate PDF
-        pdf_path = self.__generate_pdf()
+        return self.__to_temp_file(
+            self.render(pdf=False, thumb=False).image, '.png')
 
-        # Get path for new image
-        folder, pdf_filename = os.path.split(pdf_path)
+    def get_thumb(self):
+        """ Return thumbnail-sized PNG of certificate """
 
-        filename = os.path.splitext(pdf_filename)[0]
-        filename += '.png'
-        path = os.path.join(folder, filename)
+        return self.__to_temp_file(
+            self.render(pdf=False, image=False).thumb, '.png')
 
-        # Convert to PNG
-        # pylint: disable=line-too-long
-        # Sources:  http://mikelynchgames.com/software-development/using-wand-to-extract-pngs-from-pdfs/
-        #           http://stackoverflow.com/questions/27826854/python-wand-convert-pdf-to-png-disable-transparent-alpha-channel
-        with Image(filename=pdf_path, resolution=300) as img:
-            with img.convert('png') as converted:
-                converted.alpha_channel = False
-                converted.save(filename=path)
-
-        # Clean-up temp file
-        try:
-            os.remove(pdf_path)
-        except OSError as err:
-            print('{0}'.format(err))
+    def cache_key(self):
+        """ Content hash of the rendered LaTeX source and signature image """
 
-        # Return image path
+        # Render with a fixed signature location so the key does not depend
+        # on where the local signature copy happens to live
+        digest = hashlib.sha256(self.__render_latex('/', 'signature'))
+        with open(self.from_signature.name, 'rb') as sig:
+            digest.update(sig.read())
+        return digest.hexdigest()
 
-        # Special handling for Windows test environments
-        if os.name == 'nt':
-            path = path.replace('\\', '/')
+    def get_cached(self, key=None):
+        """ Return storage names of the (PNG, PDF) certificate
 
-        return path
+        Artifacts are stored under a content hash, so repeat views are served
+        from storage. Concurrent requests for the same certificate wait on a
+        single render instead of each running pdflatex. Pass key if
+        cache_key() has already been computed.
+        """
 
-    def get_thumb(self):
-        """ Return thumbnail-sized PNG of certificate """
+        key = key or self.cache_key()
+        img_name = '{0}/{1}.png'.format(CACHE_LOCATION, key)
+        pdf_name = '{0}/{1}.pdf'.format(CACHE_LOCATION, key)
 
-        # Generate PDF
-        pdf_path = self.__generate_pdf()
+        if storage.exists(img_name) and storage.exists(pdf_name):
+            return img_name, pdf_name
 
-        # Get path for new image
-        folder, pdf_filename = os.path.split(pdf_path)
-        filename = os.path.splitext(pdf_filename)[0]
-        filename += '.png'
-        path = os.path.join(folder, filename)
+        return _renders.do(
+            key, lambda: self.__render_to_storage(key, img_name, pdf_name))
 
-        # Convert to PNG
-        # pylint: disable=line-too-long
-        # Sources:  http://mikelynchgames.com/software-development/using-wand-to-extract-pngs-from-pdfs/
-        # pylint: disable=line-too-long
-        #           http://stackoverflow.com/questions/27826854/python-wand-convert-pdf-to-png-disable-transparent-alpha-channel
-        with Image(filename=pdf_path, resolution=300) as img:
-            with img.convert('png') as converted:
-                converted.alpha_channel = False
-                converted.resize(165, 125)
-                converted.save(filename=path)
-
-        # Clean-up temp file
-        try:
-            os.remove(pdf_path)
-        except OSError:
-            pass
+    # Helper method for rendering a missing certificate into storage under a
+    # file lock, so processes on this machine, web and certificate_worker
+    # alike, share the render too
+    def __render_to_storage(self, key, img_name, pdf_name):
+        with render_lock(key) as locked:
+            if not locked:
+                logging.getLogger(__name__).warning(
+                    'Rendering %s without the render lock', key)
 
-        # Special handling for Windows test environments
-        if os.name == 'nt':
-            path = path.replace('\\', '/')
+            # Another process may have published it while we waited
+            if storage.exists(img_name) and storage.exists(pdf_name):
+                return img_name, pdf_name
 
-        return path
+            rendering = self.render(thumb=False)
+            upload({img_name: rendering.image, pdf_name: rendering.pdf},
+                   self.tags)
+
+        return img_name, pdf_name
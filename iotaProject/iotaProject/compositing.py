@@ -0,0 +1,279 @@
+""" compositing.py
+
+Certificate images by compositing instead of typesetting. Everything on a
+certificate except the recipient, date and signature block depends only on
+its Award, so that background is typeset by TeX once per Award and cached.
+Each certificate then draws its variable text and signature on top.
+
+Backgrounds are named by a hash of their LaTeX source, which includes
+award.tex and the Award row, so editing either one selects a new background.
+The overlay follows the TeX layout closely but not exactly, so compositing is
+used for PNG previews and thumbnails only; PDFs are always typeset by TeX.
+"""
+
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from subprocess import check_output, CalledProcessError
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage as storage
+from wand.color import Color
+from wand.drawing import Drawing
+from wand.image import Image
+from iotaProject import certs
+
+# Storage folder for rendered backgrounds
+BACKGROUND_LOCATION = certs.CACHE_LOCATION + '/backgrounds'
+
+# Backgrounds kept in memory per process
+MEMORY_ENTRIES = 32
+
+# Resolutions each background is rasterized at
+RESOLUTIONS = (certs.IMAGE_RESOLUTION, certs.THUMB_RESOLUTION)
+
+# TeX units: scaled points per inch and points per inch
+SP_PER_INCH = 65536 * 72.27
+PT_PER_INCH = 72.27
+
+# Type sizes (pt) and tabular metrics from award.tex in a 12pt article
+NAME_SIZE = 35
+DATE_SIZE = 14.4
+SIGNER_SIZE = 12
+BASELINE_SKIP = 14.5
+TABCOLSEP = 6
+RULE_WIDTH = 0.4
+
+# Latin Modern matches the Computer Modern faces TeX uses; found through
+# kpsewhich unless CERTIFICATE_OVERLAY_FONTS names other font files
+FONT_FILES = {
+    'bold': 'lmroman12-bold.otf',
+    'italic': 'lmroman12-italic.otf',
+    'regular': 'lmroman12-regular.otf',
+}
+
+# Anchor lines written to the log by \certanchor in award.tex
+ANCHOR = re.compile(r'CERTANCHOR (\w+) (-?\d+) (-?\d+)')
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+_renders = certs.SingleFlight()
+_fonts = {}
+
+# pylint: disable=too-few-public-methods
+class Background():
+    """ A rasterized certificate background and its text anchors
+
+    Anchors are (x, y) in inches from the top-left corner of the page.
+    """
+
+    def __init__(self, png, anchors, resolution):
+        self.png = png
+        self.anchors = anchors
+        self.resolution = resolution
+
+    def anchor(self, name):
+        """ Return an anchor position in pixels """
+
+        x_in, y_in = self.anchors[name]
+        return x_in * self.resolution, y_in * self.resolution
+
+def background_source(award_type, award_template, precompiled=False):
+    """ Return the LaTeX source of an Award's certificate background """
+
+    return certs.render_source({
+        'signaturePath' : '',
+        'signature' : '',
+        'awardType' : award_type,
+        'awardColor' : award_template,
+        'precompiled' : precompiled,
+        'background' : True,
+    })
+
+def background_key(award_type, award_template):
+    """ Content hash identifying an Award's background """
+
+    return hashlib.sha256(
+        background_source(award_type, award_template)).hexdigest()
+
+def _names(key):
+    """ Storage names of the anchors and each rasterized background """
+
+    anchors_name = '{0}/{1}.json'.format(BACKGROUND_LOCATION, key)
+    png_names = {
+        resolution: '{0}/{1}-{2}.png'.format(
+            BACKGROUND_LOCATION, key, resolution)
+        for resolution in RESOLUTIONS
+    }
+    return anchors_name, png_names
+
+def _render(award_type, award_template, key):
+    """ Typeset a background once and store it at every resolution """
+
+    anchors_name, png_names = _names(key)
+
+    pool = certs.get_tex_pool()
+    pdf, log = pool.compile(
+        background_source(
+            award_type, award_template, precompiled=pool.fmt is not None),
+        log=True)
+
+    # \pdflastypos counts from the bottom of the page
+    anchors = {
+        name: [int(x) / SP_PER_INCH, certs.PAGE_HEIGHT - int(y) / SP_PER_INCH]
+        for name, x, y in ANCHOR.findall(log)
+    }
+
+    for resolution, png_name in png_names.items():
+        if not storage.exists(png_name):
+            storage.save(
+                png_name, ContentFile(certs.rasterize(pdf, resolution)))
+    if not storage.exists(anchors_name):
+        storage.save(
+            anchors_name, ContentFile(json.dumps(anchors).encode('utf-8')))
+
+def _load(award_type, award_template, key, resolution):
+    """ Read a background from storage, rendering it if missing """
+
+    anchors_name, png_names = _names(key)
+    if not (storage.exists(anchors_name) and
+            storage.exists(png_names[resolution])):
+        _render(award_type, award_template, key)
+
+    with storage.open(anchors_name, 'rb') as src:
+        anchors = json.loads(src.read().decode('utf-8'))
+    with storage.open(png_names[resolution], 'rb') as src:
+        png = src.read()
+    return Background(png, anchors, resolution)
+
+def get_background(award_type, award_template, resolution):
+    """ Return an Award's Background at one of RESOLUTIONS """
+
+    key = background_key(award_type, award_template)
+    memory_key = (key, resolution)
+
+    with _memory_lock:
+        background = _memory.get(memory_key)
+        if background is not None:
+            _memory.move_to_end(memory_key)
+            return background
+
+    # Concurrent requests for a new background share one TeX run
+    background = _renders.do(
+        memory_key,
+        lambda: _load(award_type, award_template, key, resolution))
+
+    with _memory_lock:
+        _memory[memory_key] = background
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+    return background
+
+def invalidate(award_type, award_template):
+    """ Delete the stored background of an Award's current contents """
+
+    key = background_key(award_type, award_template)
+    anchors_name, png_names = _names(key)
+    for name in [anchors_name] + list(png_names.values()):
+        storage.delete(name)
+
+    with _memory_lock:
+        for resolution in RESOLUTIONS:
+            _memory.pop((key, resolution), None)
+
+def _font(style):
+    """ Return the font file for a text style, or None for the default """
+
+    if style not in _fonts:
+        path = getattr(settings, 'CERTIFICATE_OVERLAY_FONTS', {}).get(style)
+        if path is None:
+            try:
+                path = check_output(
+                    ['kpsewhich', FONT_FILES[style]]).decode().strip() or None
+            except (OSError, CalledProcessError):
+                path = None
+        _fonts[style] = path
+    return _fonts[style]
+
+def _text(draw, style, size, x, y, text):
+    """ Queue centred text on a baseline """
+
+    font = _font(style)
+    if font is not None:
+        draw.font = font
+    draw.font_size = size
+    draw.text(int(round(x)), int(round(y)), text)
+
+# pylint: disable=too-many-locals
+def composite(certificate, resolution, size=None):
+    """ Return PNG bytes of a Certificate composited at a resolution
+
+    resolution must be one of RESOLUTIONS; size optionally resizes the
+    result to (width, height) pixels.
+    """
+
+    background = get_background(
+        certificate.award_type, certificate.award_template, resolution)
+
+    # Pixels per TeX point
+    scale = resolution / PT_PER_INCH
+
+    with Image(blob=background.png) as img:
+        with Drawing() as draw:
+            draw.fill_color = Color('black')
+            draw.text_alignment = 'center'
+
+            x, y = background.anchor('name')
+            _text(draw, 'bold', NAME_SIZE * scale, x, y, certificate.to_name)
+
+            x, y = background.anchor('date')
+            _text(draw, 'italic', DATE_SIZE * scale, x, y,
+                  'On this {0} day of {1} in the year {2}.'.format(
+                      certificate.day, certificate.month, certificate.year))
+
+            # Signature block: a centred tabular column, flush right, with
+            # the signature over a rule over the awarder's name
+            right, bottom = background.anchor('signature')
+            font = _font('regular')
+            if font is not None:
+                draw.font = font
+            draw.font_size = SIGNER_SIZE * scale
+            name_width = draw.get_font_metrics(
+                img, certificate.from_name).text_width
+
+            with Image(filename=certificate.from_signature.name) as sig:
+                # pdfTeX sizes images by their density, 72 dpi if unset
+                density = sig.resolution[0] or 72
+                sig_width = sig.width * resolution / density
+                sig_height = sig.height * resolution / density
+
+                width = max(sig_width, name_width) + 2 * TABCOLSEP * scale
+                center = right - width / 2
+
+                # Each row is a strut: 0.7 baselineskip high, 0.3 deep
+                name_baseline = bottom - 0.3 * BASELINE_SKIP * scale
+                rule_y = bottom - BASELINE_SKIP * scale
+                sig_bottom = rule_y - (RULE_WIDTH + 0.3 * BASELINE_SKIP) * scale
+
+                _text(draw, 'regular', SIGNER_SIZE * scale,
+                      center, name_baseline, certificate.from_name)
+
+                draw.stroke_color = Color('black')
+                draw.stroke_width = max(1, RULE_WIDTH * scale)
+                draw.line((int(right - width), int(rule_y)),
+                          (int(right), int(rule_y)))
+                draw(img)
+
+                sig.resize(max(1, int(sig_width)), max(1, int(sig_height)))
+                img.composite(
+                    sig,
+                    int(center - sig_width / 2),
+                    int(sig_bottom - sig_height))
+
+        img.alpha_channel = False
+        if size is not None:
+            img.resize(*size)
+        img.format = 'png'
+        return img.make_blob()
@@ -0,0 +1,139 @@
+""" diskcache.py
+
+A size-bounded cache of files on local disk, shared by every process on the
+machine. Entries are named by a hash of their key. An entry's modification
+time is when it was written and its access time when it was last read; the
+least recently read entries are deleted once the cache grows past its byte
+budget.
+"""
+
+import os
+import time
+import errno
+import shutil
+import hashlib
+import logging
+import threading
+from tempfile import mkstemp
+
+# Suffix of files being written into the cache
+PARTIAL_SUFFIX = '.part'
+
+logger = logging.getLogger(__name__)
+
+class DiskLRUCache():
+    """ Files on local disk under a byte budget, evicted least recently used """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Bytes in the cache, counted on first write; other processes write
+        # too, so this is corrected by a scan whenever it exceeds the budget
+        self._size = None
+
+    def path(self, key):
+        """ Return the file path an entry is stored at """
+
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest[:2], digest)
+
+    def open(self, key, max_age=None):
+        """ Return an entry opened for binary reading, or None if missing
+
+        Entries written more than max_age seconds ago count as missing.
+        """
+
+        path = self.path(key)
+        try:
+            src = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            written = os.fstat(src.fileno()).st_mtime
+            now = time.time()
+            if max_age is not None and now - written > max_age:
+                src.close()
+                return None
+            # Set explicitly; mounts with noatime don't record reads
+            os.utime(path, (now, written))
+        except FileNotFoundError:
+            # Evicted since it was opened; the open file stays readable
+            pass
+        return src
+
+    def put(self, key, src):
+        """ Store the contents of a binary file object as an entry """
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, partial = mkstemp(
+            dir=os.path.dirname(path), suffix=PARTIAL_SUFFIX)
+        try:
+            with os.fdopen(handle, 'wb') as dest:
+                shutil.copyfileobj(src, dest)
+                size = dest.tell()
+            os.replace(partial, path)
+        except BaseException:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            raise
+        self.__grow(size)
+        return path
+
+    def delete(self, key):
+        """ Remove an entry if present """
+
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """ Remove every entry """
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+        with self._lock:
+            self._size = 0
+
+    def evict(self):
+        """ Delete least recently used entries until the cache fits its budget """
+
+        entries = []
+        for dirpath, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                if filename.endswith(PARTIAL_SUFFIX):
+                    # Still being written by put()
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    logger.warning('Could not evict %s: %s', path, error)
+                    continue
+            size -= entry_size
+
+        with self._lock:
+            self._size = size
+
+    # Count bytes written, evicting when over budget
+    def __grow(self, size):
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            over_budget = self._size is None or self._size > self.max_bytes
+        if over_budget:
+            self.evict()
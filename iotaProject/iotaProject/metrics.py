@@ -0,0 +1,150 @@
+""" metrics.py
+
+Timing spans for the certificate pipeline. Each span is logged through the
+'iotaProject.metrics' logger and recorded in an in-process registry.
+Renders mostly run in certificate_worker processes, so the administrator
+metrics page and `manage.py certificate_metrics` summarize percentiles
+from the metrics log, which every process on the machine writes to.
+"""
+
+import os
+import re
+import glob
+import time
+import logging
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+# Samples kept per (stage, award type)
+MAX_SAMPLES = 1000
+
+logger = logging.getLogger(__name__)
+
+# A span as logged by span()
+LOG_LINE = re.compile(
+    r'stage=(?P<stage>\S+) ms=(?P<ms>[0-9.]+) award=\S* '
+    r'award_type=(?P<award_type>.*)$')
+
+class Registry():
+    """ Thread-safe store of recent span durations in milliseconds """
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=max_samples))
+
+    def record(self, stage, duration_ms, award_type=None):
+        """ Add one duration for a stage """
+
+        with self._lock:
+            self._samples[(stage, award_type)].append(duration_ms)
+
+    def clear(self):
+        """ Drop all samples """
+
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self, quantiles=(50, 90, 99)):
+        """ Return one row per (stage, award type) with count and percentiles """
+
+        with self._lock:
+            samples = {key: list(values) for key, values in self._samples.items()}
+
+        rows = []
+        for (stage, award_type), values in sorted(
+                samples.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            values.sort()
+            rows.append({
+                'stage': stage,
+                'award_type': award_type,
+                'count': len(values),
+                'percentiles': [
+                    (quantile, percentile(values, quantile))
+                    for quantile in quantiles
+                ],
+                'max': values[-1],
+            })
+        return rows
+
+def percentile(values, quantile):
+    """ Nearest-rank percentile of a sorted, non-empty list """
+
+    rank = int(round(quantile / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+registry = Registry()
+
+def log_paths(backups=True):
+    """ Files of the LOGGING 'metrics' handler, oldest first
+
+    Backups are the rotated files named like metrics.log.1, the newest.
+    With backups=False only the file being written is returned.
+    """
+
+    from django.conf import settings
+    path = settings.LOGGING['handlers']['metrics']['filename']
+    paths = [path]
+    if backups:
+        numbered = []
+        for backup in glob.glob(glob.escape(path) + '.*'):
+            suffix = backup[len(path) + 1:]
+            if suffix.isdigit():
+                numbered.append((int(suffix), backup))
+        paths = [backup for _, backup in sorted(numbered, reverse=True)] + \
+            paths
+    return [path for path in paths if os.path.exists(path)]
+
+def read_log(paths, max_samples=MAX_SAMPLES, max_bytes=None):
+    """ Return a Registry of the spans logged in files, read in order
+
+    With max_bytes, only the lines in the last max_bytes of each file are
+    read.
+    """
+
+    log_registry = Registry(max_samples)
+    for path in paths:
+        with open(path, 'rb') as src:
+            size = os.fstat(src.fileno()).st_size
+            if max_bytes is not None and size > max_bytes:
+                src.seek(size - max_bytes)
+                # Skip the line cut in two
+                src.readline()
+            for line in src:
+                match = LOG_LINE.search(
+                    line.decode('utf-8', 'replace').rstrip('\n'))
+                if match is None:
+                    continue
+                award_type = match.group('award_type')
+                log_registry.record(
+                    match.group('stage'), float(match.group('ms')),
+                    None if award_type == 'None' else award_type)
+    return log_registry
+
+_context = threading.local()
+
+@contextmanager
+def tagged(**tags):
+    """ Attach tags (award, award_type) to spans opened inside the block """
+
+    previous = getattr(_context, 'tags', {})
+    _context.tags = dict(previous, **tags)
+    try:
+        yield
+    finally:
+        _context.tags = previous
+
+@contextmanager
+def span(stage, **tags):
+    """ Time a block as one pipeline stage """
+
+    tags = dict(getattr(_context, 'tags', {}), **tags)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = 1000 * (time.perf_counter() - start)
+        registry.record(stage, duration_ms, tags.get('award_type'))
+        logger.info(
+            'stage=%s ms=%.1f award=%s award_type=%s',
+            stage, duration_ms, tags.get('award'), tags.get('award_type'))
@@ -47,6 +47,7 @@ MIDDLEWARE_CLASSES = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    'teamiota.middleware.NormalUserMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -138,6 +139,50 @@ USE_TZ = True
 
 LOGIN_URL = 'normalUserLogin'
 
+# Email logins first; usernames still work for the Django admin
+AUTHENTICATION_BACKENDS = [
+    'teamiota.backends.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Sessions are cached for up to SESSION_CACHE_TTL seconds in front of the
+# database by teamiota.sessions, in a cache every server must share so a
+# logout ends the session everywhere at once:
+# - SESSION_CACHE_LOCATION (host:port of a memcached all servers use, e.g.
+#   ElastiCache) caches them in memcached; needs python-memcached
+# - otherwise, outside production (RDS_DB_NAME unset, so a single host),
+#   they are cached in a file cache shared by that host's processes, in
+#   shared memory where there is any
+# - otherwise sessions stay plain database sessions: a cache local to each
+#   of several servers would keep logged-out sessions alive elsewhere
+SESSION_CACHE_LOCATION = os.environ.get('SESSION_CACHE_LOCATION')
+SESSION_CACHE_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else \
+    os.path.join(BASE_DIR, 'cache')
+SESSION_CACHE_TTL = 60
+
+if SESSION_CACHE_LOCATION:
+    CACHES['sessions'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': SESSION_CACHE_LOCATION,
+        'KEY_PREFIX': 'teamiota',
+    }
+elif 'RDS_DB_NAME' not in os.environ:
+    CACHES['sessions'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(SESSION_CACHE_DIR, 'teamiota-sessions'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
+if 'sessions' in CACHES:
+    SESSION_ENGINE = 'teamiota.sessions'
+    SESSION_CACHE_ALIAS = 'sessions'
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 STATIC_URL = '/static/'
@@ -146,6 +191,66 @@ MEDIA_URL = '/media/'
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# custom_storages.StaticStorage and MediaStorage keep a local disk copy of
+# files in front of their S3 BACKEND, up to MAX_BYTES. Local copies older
+# than MAX_AGE seconds are refetched, since other servers may overwrite them
+TIERED_STORAGE = {
+    'static': {
+        'BACKEND': 'custom_storages.StaticS3Storage',
+        'DIR': os.path.join(BASE_DIR, 'cache', 'static'),
+        'MAX_BYTES': 128 * 1024 * 1024,
+        'MAX_AGE': None,
+    },
+    'media': {
+        'BACKEND': 'custom_storages.MediaS3Storage',
+        'DIR': os.path.join(BASE_DIR, 'cache', 'media'),
+        'MAX_BYTES': 512 * 1024 * 1024,
+        'MAX_AGE': 300,
+    },
+}
+
+# Cache-Control of media stored on S3, by name prefix. Certificate artifacts
+# are named by their content and never change, so browsers may keep them
+ARTIFACT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+MEDIA_CACHE_CONTROL = {
+    'certificates/': ARTIFACT_CACHE_CONTROL,
+    'teamiota/certThumbs/': ARTIFACT_CACHE_CONTROL,
+}
+
+# Email is stored by SpoolingEmailBackend and sent in batches by
+# manage.py send_spooled_mail through SPOOLED_EMAIL_BACKEND
+EMAIL_BACKEND = 'teamiota.mail.SpoolingEmailBackend'
+SPOOLED_EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+SPOOLED_EMAIL_MAX_ATTEMPTS = 8
+
+# Certificate rendering
+# pdflatex command, number of pdflatex workers per process and where they
+# keep their scratch directories and the precompiled preamble format
+CERTIFICATE_PDFLATEX = ['pdflatex']
+CERTIFICATE_TEX_WORKERS = 2
+CERTIFICATE_TEX_DIR = os.path.join(BASE_DIR, 'tex')
+
+# Lock files letting the processes on this machine share certificate renders
+CERTIFICATE_RENDER_LOCK_DIR = os.path.join(BASE_DIR, 'cache', 'locks')
+
+# Threads per process uploading rendered certificates to storage
+CERTIFICATE_UPLOAD_THREADS = 4
+
+# Local disk cache of awarders' signature images, shared by the processes
+# on this machine
+CERTIFICATE_SIGNATURE_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'signatures')
+CERTIFICATE_SIGNATURE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Composite thumbnails and previews over cached per-Award backgrounds instead
+# of typesetting them; fonts default to Latin Modern found via kpsewhich, or
+# map 'bold', 'italic' and 'regular' to font files here
+CERTIFICATE_COMPOSITING = True
+CERTIFICATE_OVERLAY_FONTS = {}
+
+# Background certificate jobs (manage.py certificate_worker)
+CERTIFICATE_JOB_MAX_ATTEMPTS = 5
+CERTIFICATE_JOB_TIMEOUT = 600
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -173,6 +278,14 @@ LOGGING = {
             'maxBytes': 1024*1024*15, #15MB
             'backupCount': 10,
         },
+        # Written by the web and certificate_worker processes alike, which
+        # can't rotate one file safely: rotate it externally, e.g. logrotate
+        # renaming to metrics.log.1, .2, ...; each process reopens the file
+        'metrics': {
+            'level': 'INFO',
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': os.path.join(BASE_DIR, 'metrics.log'),
+        },
     },
     'loggers': {
         'teamiota': {
@@ -185,6 +298,17 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'iotaProject': {
+            'handlers': ['django'],
+            'level': 'INFO',
+            'propagate': True,
+        },
+        # Certificate pipeline timing spans
+        'iotaProject.metrics': {
+            'handlers': ['metrics'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
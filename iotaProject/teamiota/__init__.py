@@ -2,3 +2,5 @@ import logging
 logger = logging.getLogger(__name__)
 logger.debug('debug level message from teamiota.__init__.py')
 logger.error('error level message from teamiota.__init__.py')
+
+default_app_config = 'teamiota.apps.TeamiotaConfig'
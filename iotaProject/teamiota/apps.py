@@ -1,5 +1,25 @@
+""" teamiota/apps.py """
+
 from django.apps import AppConfig
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.signals import post_migrate
+
+# Index for case-insensitive email lookups (email__iexact) on PostgreSQL
+EMAIL_INDEX_SQL = ('CREATE INDEX IF NOT EXISTS auth_user_email_upper '
+                   'ON auth_user (UPPER(email::text))')
+
+def create_email_index(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """ Index auth_user emails for teamiota.backends.EmailBackend """
 
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(EMAIL_INDEX_SQL)
 
 class TeamiotaConfig(AppConfig):
+    """ Create the email index after migrations """
+
     name = 'teamiota'
+
+    def ready(self):
+        post_migrate.connect(create_email_index, sender=self)
@@ -0,0 +1,133 @@
+""" teamiota/artifacts.py
+
+Garbage collection of stored certificate files. Deleting AwardEvents only
+records their thumbnails, PNGs and PDFs as OrphanedArtifact rows, in bulk
+and inside the delete's transaction; `manage.py collect_artifacts` later
+removes them from storage in batches. Its reconcile mode records stored
+files that no AwardEvent refers to, such as those left by deletions made
+before this module existed.
+"""
+
+import logging
+from datetime import timedelta
+from django.core.files.storage import default_storage as storage
+from django.utils import timezone
+from teamiota.models import AwardEvent, OrphanedArtifact, CERT_THUMB_LOCATION
+from iotaProject import certs
+
+# Seconds a file found by reconcile() is kept before collection, so that
+# artifacts being uploaded before their AwardEvent row is saved survive
+RECONCILE_GRACE = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+def certificate_names(key):
+    """ Storage names of the full-sized PNG and PDF of a certificate key """
+
+    return ['{0}/{1}.{2}'.format(certs.CACHE_LOCATION, key, ext)
+            for ext in ('png', 'pdf')]
+
+def record(award_events):
+    """ Record the stored files of AwardEvents about to be deleted """
+
+    names = set()
+    for thumb, key in award_events.values_list('certThumbnail', 'certKey'):
+        if thumb:
+            names.add(thumb)
+        if key:
+            names.update(certificate_names(key))
+
+    OrphanedArtifact.objects.bulk_create(
+        [OrphanedArtifact(name=name) for name in sorted(names)])
+    return len(names)
+
+def in_use(names):
+    """ Return the names still referred to by an AwardEvent
+
+    Full-sized certificates are shared by AwardEvents with identical
+    content, so one may outlive the AwardEvent it was recorded for.
+    """
+
+    names = set(names)
+    used = set(AwardEvent.objects.
+               filter(certThumbnail__in=list(names)).
+               values_list('certThumbnail', flat=True))
+    keys = {
+        name.rsplit('/', 1)[1].rsplit('.', 1)[0]
+        for name in names
+        if name.startswith(certs.CACHE_LOCATION + '/')
+    }
+    for key in AwardEvent.objects.\
+            filter(certKey__in=list(keys)).\
+            values_list('certKey', flat=True):
+        used.update(certificate_names(key))
+    return used & names
+
+def collect(batch_size=100):
+    """ Delete one batch of due orphaned files
+
+    Returns how many recorded files were settled, deleted or found in use.
+    """
+
+    batch = list(OrphanedArtifact.objects.
+                 filter(collectAfter__lte=timezone.now()).
+                 order_by('collectAfter', 'id')[:batch_size])
+    if not batch:
+        return 0
+
+    names = {orphan.name for orphan in batch}
+    names -= in_use(names)
+
+    # Deletions run concurrently on the upload threads
+    futures = {
+        name: certs.submit_upload(
+            lambda n=name: storage.delete(n), stage='storage_delete')
+        for name in names
+    }
+    failed = {}
+    try:
+        certs.wait_for_uploads(futures)
+    except certs.UploadError as error:
+        failed = error.errors
+        logger.warning('%s', error)
+
+    # Failed deletions stay recorded for the next pass
+    settled, _ = OrphanedArtifact.objects.\
+        filter(id__in=[orphan.id for orphan in batch]).\
+        exclude(name__in=list(failed)).\
+        delete()
+    return settled
+
+def collect_all(batch_size=100):
+    """ Collect batches until none settles anything; return the total """
+
+    total = 0
+    while True:
+        settled = collect(batch_size)
+        if not settled:
+            return total
+        total += settled
+
+def reconcile(grace=RECONCILE_GRACE, batch_size=500):
+    """ Record stored artifacts no AwardEvent refers to; return how many """
+
+    stored = []
+    for location in (certs.CACHE_LOCATION, CERT_THUMB_LOCATION):
+        # Subdirectories (backgrounds) are not per-award artifacts
+        _, files = storage.listdir(location)
+        stored.extend('{0}/{1}'.format(location, name) for name in files)
+
+    collect_after = timezone.now() + timedelta(seconds=grace)
+    found = 0
+    for start in range(0, len(stored), batch_size):
+        names = set(stored[start:start + batch_size])
+        names -= in_use(names)
+        names -= set(OrphanedArtifact.objects.
+                     filter(name__in=list(names)).
+                     values_list('name', flat=True))
+        OrphanedArtifact.objects.bulk_create([
+            OrphanedArtifact(name=name, collectAfter=collect_after)
+            for name in sorted(names)
+        ])
+        found += len(names)
+    return found
@@ -0,0 +1,43 @@
+""" teamiota/backends.py """
+
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+
+class EmailBackend(ModelBackend):
+    """ Authenticate by email and password, hashing the password once
+
+    The email is matched case-insensitively, which on PostgreSQL uses the
+    UPPER(email) index created by teamiota.apps. Users come back with their
+    NormalUser, so the login view and later requests need no second query;
+    get_user also joins the department and location for request.normal_user.
+    """
+
+    def authenticate(self, email=None, password=None, **kwargs):
+        if email is None:
+            # Not an email login; leave it to the other backends
+            return None
+
+        user = User.objects.\
+            select_related('normaluser').\
+            filter(email__iexact=email).\
+            order_by('id').\
+            first()
+        if user is None:
+            # Hash anyway so response times don't reveal which emails exist
+            User().set_password(password)
+        elif user.check_password(password) and self.user_can_authenticate(user):
+            return user
+
+        # Stop here: later backends would hash the password again
+        raise PermissionDenied
+
+    def get_user(self, user_id):
+        try:
+            user = User.objects.\
+                select_related('normaluser__department',
+                               'normaluser__location').\
+                get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
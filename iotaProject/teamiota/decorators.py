@@ -0,0 +1,33 @@
+""" teamiota/decorators.py
+
+View decorators that check request.normal_user, set by
+teamiota.middleware.NormalUserMiddleware, so permission checks cost no
+queries of their own.
+"""
+
+from functools import wraps
+from django.contrib.auth.views import redirect_to_login
+
+def normal_user_passes_test(test_func, login_url=None):
+    """ Redirect to the login page unless test_func(request.normal_user)
+
+    Anonymous users and users without a NormalUser never pass.
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            # The lazy object proxies bool(), so it is false for no profile
+            normal_user = request.normal_user
+            if normal_user and test_func(normal_user):
+                return view_func(request, *args, **kwargs)
+            return redirect_to_login(request.get_full_path(), login_url)
+        return wrapped_view
+    return decorator
+
+def admin_required(view_func=None, login_url=None):
+    """ Allow only logged in administrators """
+
+    decorator = normal_user_passes_test(
+        lambda normal_user: normal_user.isAdmin, login_url)
+    return decorator(view_func) if view_func else decorator
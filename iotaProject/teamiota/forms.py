@@ -1,9 +1,7 @@
 """ teamiota/forms.py """
 
 from django import forms
-from django.contrib.auth.hashers import check_password
 from django.contrib.auth import authenticate
-from django.db.models import Q
 from teamiota.models import User, NormalUser, AwardEvent
 
 class SignatureWidget(forms.widgets.ClearableFileInput):
@@ -26,9 +24,7 @@ class NormalUserLoginForm(forms.Form):
     def get_user(self):
         """ Return valid User """
 
-        this_user = User.objects.get(Q(email=self.email))
-        username = this_user.get_username()
-        return authenticate(username=username, password=self.password)
+        return self.user
 
     def is_valid(self):
         """
@@ -47,23 +43,19 @@ class NormalUserLoginForm(forms.Form):
         self.email = self.cleaned_data['email']
         self.password = self.cleaned_data['password']
 
-        # Retrieve User from db
-        try:
-            this_user = User.objects.get(
-                Q(email=self.email)
-            )
+        # Hashes the password once; see teamiota.backends.EmailBackend
+        self.user = authenticate(email=self.email, password=self.password)
+        if self.user is not None:
+            return True
 
         # Email not in DB
-        except User.DoesNotExist:
+        if not User.objects.filter(email__iexact=self.email).exists():
             self.add_error('email', 'User does not exist')
-            return False
 
         # Password is incorrect for existing email
-        if not check_password(self.password, this_user.password):
+        else:
             self.add_error('password', 'Password is invalid')
-            return False
-
-        return True
+        return False
 
 class NormalUserEditForm(forms.ModelForm):
     """ Edit Form for Normal User """
@@ -86,7 +78,9 @@ class NewAwardForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(NewAwardForm, self).__init__(*args, **kwargs)
-        self.fields['awardee'].queryset = NormalUser.objects.filter(isAdmin=False)
+        # Choices are labelled with the user's email
+        self.fields['awardee'].queryset = NormalUser.objects.\
+            filter(isAdmin=False).select_related('user')
         self.fields['awardee'].required = True
         self.fields['awardType'].required = True
 
@@ -0,0 +1,176 @@
+""" teamiota/jobs.py
+
+Database-backed queue for certificate jobs. The queue is the AwardEvent
+table itself: certStatus tracks each award's certificate, and workers
+started with `manage.py certificate_worker` claim pending rows with a
+conditional UPDATE, so no broker is needed on PostgreSQL or SQLite.
+"""
+
+import time
+import logging
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from teamiota.models import AwardEvent, thumb_name
+from iotaProject.certs import Certificate
+from iotaProject import certs
+
+# Attempts before a job is marked failed
+MAX_ATTEMPTS = getattr(settings, 'CERTIFICATE_JOB_MAX_ATTEMPTS', 5)
+
+# Seconds before a running job is presumed dead and requeued
+JOB_TIMEOUT = getattr(settings, 'CERTIFICATE_JOB_TIMEOUT', 600)
+
+# Seconds to wait before the first retry, doubled on each attempt
+RETRY_DELAY = 30
+
+logger = logging.getLogger(__name__)
+
+def enqueue(award_event):
+    """ Queue certificate rendering, storage and email for an AwardEvent """
+
+    award_event.certStatus = AwardEvent.CERT_PENDING
+    award_event.certAttempts = 0
+    award_event.certRunAfter = timezone.now()
+    award_event.certLockedAt = None
+    award_event.certError = ''
+    award_event.save()
+
+def enqueue_many(award_events, batch_size=1000):
+    """ Insert new AwardEvents with their certificate jobs queued
+
+    Rows are inserted batch_size at a time; workers pick the jobs up in
+    insertion order.
+    """
+
+    now = timezone.now()
+    for award_event in award_events:
+        award_event.certStatus = AwardEvent.CERT_PENDING
+        award_event.certAttempts = 0
+        award_event.certRunAfter = now
+        award_event.certLockedAt = None
+        award_event.certError = ''
+    AwardEvent.objects.bulk_create(award_events, batch_size=batch_size)
+
+def requeue_stale():
+    """ Return jobs whose worker died mid-run to the queue """
+
+    cutoff = timezone.now() - timedelta(seconds=JOB_TIMEOUT)
+    return AwardEvent.objects.\
+        filter(certStatus=AwardEvent.CERT_RUNNING, certLockedAt__lt=cutoff).\
+        update(certStatus=AwardEvent.CERT_PENDING, certLockedAt=None)
+
+def claim():
+    """ Claim the next due job, or return None if the queue is empty """
+
+    now = timezone.now()
+    candidates = AwardEvent.objects.\
+        filter(certStatus=AwardEvent.CERT_PENDING, certRunAfter__lte=now).\
+        order_by('certRunAfter', 'id').\
+        values_list('id', flat=True)[:10]
+
+    for award_id in candidates:
+        # Only one worker's UPDATE can match while the row is still pending
+        claimed = AwardEvent.objects.\
+            filter(id=award_id, certStatus=AwardEvent.CERT_PENDING).\
+            update(
+                certStatus=AwardEvent.CERT_RUNNING,
+                certLockedAt=now,
+                certAttempts=F('certAttempts') + 1)
+        if claimed:
+            return AwardEvent.objects.get(id=award_id)
+
+    return None
+
+def process(award_event):
+    """ Render, store and email the certificate for a claimed AwardEvent """
+
+    with Certificate(award_event.id) as this_cert:
+        rendering = this_cert.render(image=False)
+
+        # Save thumbnail to AwardEvent instance while the email is sent
+        thumb_upload = certs.submit_upload(
+            lambda: award_event.certThumbnail.save(
+                thumb_name(rendering.thumb), ContentFile(rendering.thumb),
+                save=False),
+            this_cert.tags)
+
+        # The spooled email is only committed once the upload succeeded, so
+        # a retried job does not email twice
+        with transaction.atomic():
+            # Send congratulatory email
+            this_cert.email(rendering.pdf)
+
+            certs.wait_for_uploads({'thumbnail': thumb_upload})
+            award_event.certStatus = AwardEvent.CERT_DONE
+            award_event.certLockedAt = None
+            award_event.certError = ''
+            award_event.save(update_fields=[
+                'certThumbnail', 'certStatus', 'certLockedAt', 'certError'])
+
+def regenerate(award_id):
+    """ Replace the stored thumbnail of an AwardEvent without emailing
+
+    The certificate job's status is left alone, so an unfinished job still
+    runs and sends its email.
+    """
+
+    award_event = AwardEvent.objects.get(id=award_id)
+    with Certificate(award_id) as this_cert:
+        rendering = this_cert.render(pdf=False, image=False)
+
+    stale_name = award_event.certThumbnail.name
+    award_event.certThumbnail.save(
+        thumb_name(rendering.thumb), ContentFile(rendering.thumb), save=False)
+    award_event.save(update_fields=['certThumbnail'])
+
+    # Thumbnails are named by content, so an unchanged one keeps its name
+    if stale_name and stale_name != award_event.certThumbnail.name:
+        award_event.certThumbnail.storage.delete(stale_name)
+
+def fail(award_event, error):
+    """ Schedule a retry with backoff, or mark the job failed """
+
+    if award_event.certAttempts >= MAX_ATTEMPTS:
+        award_event.certStatus = AwardEvent.CERT_FAILED
+    else:
+        award_event.certStatus = AwardEvent.CERT_PENDING
+        award_event.certRunAfter = timezone.now() + timedelta(
+            seconds=RETRY_DELAY * 2 ** (award_event.certAttempts - 1))
+    award_event.certLockedAt = None
+    award_event.certError = error
+    award_event.save(update_fields=[
+        'certStatus', 'certRunAfter', 'certLockedAt', 'certError'])
+
+def run_once():
+    """ Process one job; return False if there was nothing to do """
+
+    award_event = claim()
+    if award_event is None:
+        return False
+
+    try:
+        process(award_event)
+    # pylint: disable=broad-except
+    except Exception:
+        logger.error(
+            'Certificate job for AwardEvent %s failed (attempt %s)',
+            award_event.id, award_event.certAttempts, exc_info=True)
+        fail(award_event, traceback.format_exc())
+
+    return True
+
+def run_worker(poll_interval=1.0, burst=False):
+    """ Process jobs until interrupted, or until the queue is empty in burst mode """
+
+    while True:
+        requeue_stale()
+        while run_once():
+            pass
+        if burst:
+            return
+        time.sleep(poll_interval)
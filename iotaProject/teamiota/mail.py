@@ -0,0 +1,181 @@
+""" teamiota/mail.py
+
+Spooled email. With EMAIL_BACKEND set to SpoolingEmailBackend, sending
+(certificate emails, password resets) only stores the message in the
+database, serialized with its sender and recipients. `manage.py
+send_spooled_mail` later sends stored messages in batches over one reused
+connection to SPOOLED_EMAIL_BACKEND, retrying failures with exponential
+backoff. When the connection can't be opened at all, claimed messages are
+handed back without using up their attempts.
+"""
+
+import uuid
+import logging
+from datetime import timedelta
+from email import message_from_bytes
+from email.message import Message
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.message import MIMEMixin
+from django.utils import timezone
+from teamiota.models import SpooledEmail
+
+# Attempts before a message is left in the spool unsent
+MAX_ATTEMPTS = getattr(settings, 'SPOOLED_EMAIL_MAX_ATTEMPTS', 8)
+
+# Seconds to wait before the first retry, doubled on each attempt
+RETRY_DELAY = 60
+
+# Seconds a drain may hold claimed messages before others may retry them
+CLAIM_TIMEOUT = 600
+
+logger = logging.getLogger(__name__)
+
+class SpoolingEmailBackend(BaseEmailBackend):
+    """ Email backend that stores messages for send_spooled_mail """
+
+    def send_messages(self, email_messages):
+        """ Store messages in the spool; return how many were stored """
+
+        now = timezone.now()
+        spooled = []
+        for email_message in email_messages:
+            # Like Django's backends, skip messages nobody would receive
+            if not email_message.recipients():
+                continue
+            spooled.append(SpooledEmail(
+                message=email_message.message().as_bytes(),
+                fromEmail=email_message.from_email,
+                recipients='\n'.join(email_message.recipients()),
+                sendAfter=now))
+
+        SpooledEmail.objects.bulk_create(spooled)
+        return len(spooled)
+
+class SpooledMIMEMessage(MIMEMixin, Message):
+    """ A stored message parsed back, written out like Django's messages """
+
+class SpooledMessage():
+    """ A stored message with the EmailMessage methods email backends use """
+
+    # The stored message is already encoded
+    encoding = None
+
+    def __init__(self, spooled):
+        self.from_email = spooled.fromEmail
+        self.to = spooled.recipients.split('\n')
+        self.data = bytes(spooled.message)
+
+    def recipients(self):
+        return self.to
+
+    def message(self):
+        return message_from_bytes(self.data, _class=SpooledMIMEMessage)
+
+def claim(batch_size):
+    """ Claim up to batch_size due messages for this drain """
+
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = SpooledEmail.objects.\
+        filter(sendAfter__lte=now, attempts__lt=MAX_ATTEMPTS).\
+        order_by('sendAfter', 'id').\
+        values_list('id', flat=True)[:batch_size]
+
+    # Pushing sendAfter forward hides claimed rows from other drains until
+    # the claim times out
+    SpooledEmail.objects.\
+        filter(id__in=list(due), sendAfter__lte=now).\
+        update(
+            claimToken=token,
+            sendAfter=now + timedelta(seconds=CLAIM_TIMEOUT))
+    return list(SpooledEmail.objects.filter(claimToken=token).order_by('id'))
+
+def drain(batch_size=100, backend=None):
+    """ Send every due message over one connection; return (sent, failed)
+
+    Errors opening the connection are raised, after handing the claimed
+    messages not yet tried back to the spool.
+    """
+
+    connection = get_connection(
+        backend or getattr(settings, 'SPOOLED_EMAIL_BACKEND', None))
+    sent = failed = 0
+
+    connection.open()
+    try:
+        while True:
+            batch = claim(batch_size)
+            if not batch:
+                break
+
+            delivered = []
+            try:
+                for spooled in batch:
+                    try:
+                        connection.send_messages([SpooledMessage(spooled)])
+                    # pylint: disable=broad-except
+                    except Exception as exception:
+                        failed += 1
+                        retry(spooled, exception)
+
+                        # Start the next message on a fresh connection
+                        connection.close()
+                        connection.open()
+                    else:
+                        sent += 1
+                        delivered.append(spooled.id)
+            # pylint: disable=broad-except
+            except Exception as exception:
+                # retry() cleared the claims of the messages already tried
+                release([spooled for spooled in batch
+                         if spooled.claimToken and
+                         spooled.id not in delivered], exception)
+                raise
+            finally:
+                SpooledEmail.objects.filter(id__in=delivered).delete()
+    finally:
+        connection.close()
+
+    return sent, failed
+
+def release(claimed, exception):
+    """ Hand claimed messages back to the spool after RETRY_DELAY
+
+    For messages that were never tried, as when the connection is down;
+    their attempts are left alone so an outage doesn't use them up.
+    """
+
+    if not claimed:
+        return
+
+    # Rows whose claim timed out may have been claimed by another drain
+    SpooledEmail.objects.\
+        filter(
+            id__in=[spooled.id for spooled in claimed],
+            claimToken=claimed[0].claimToken).\
+        update(
+            claimToken='',
+            sendAfter=timezone.now() + timedelta(seconds=RETRY_DELAY),
+            lastError='{0}'.format(exception))
+    logger.warning('Could not send %s spooled emails, releasing them: %s',
+                   len(claimed), exception)
+
+def retry(spooled, exception):
+    """ Schedule a failed message for another attempt with backoff """
+
+    spooled.attempts += 1
+    spooled.sendAfter = timezone.now() + timedelta(
+        seconds=RETRY_DELAY * 2 ** (spooled.attempts - 1))
+    spooled.claimToken = ''
+    spooled.lastError = '{0}'.format(exception)
+    spooled.save(update_fields=[
+        'attempts', 'sendAfter', 'claimToken', 'lastError'])
+
+    if spooled.attempts >= MAX_ATTEMPTS:
+        logger.error('Giving up on spooled email %s: %s',
+                     spooled.id, exception)
+    else:
+        logger.warning('Spooled email %s failed (attempt %s): %s',
+                       spooled.id, spooled.attempts, exception)
@@ -0,0 +1,77 @@
+""" teamiota/management/commands/benchmark_certificates.py """
+
+import json
+import shutil
+import tempfile
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from iotaProject import bench
+
+class Command(BaseCommand):
+    """ Benchmark the certificate pipeline without S3, SMTP or a database """
+
+    help = ('Measure get_thumb, get_image, get_pdf and email latency, '
+            'throughput and peak RSS at several concurrency levels')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tex', choices=('stub', 'real'), default='stub',
+            help='Compile with a pdflatex stand-in or with CERTIFICATE_PDFLATEX')
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 4, 16],
+            help='Concurrent renders to measure at')
+        parser.add_argument(
+            '--iterations', type=int, default=5,
+            help='Operations run by each concurrent thread')
+        parser.add_argument(
+            '--operations', nargs='+', choices=bench.OPERATIONS,
+            default=list(bench.OPERATIONS), help='Operations to measure')
+        parser.add_argument(
+            '--tex-workers', type=int,
+            help='TeX worker pool size (default: CERTIFICATE_TEX_WORKERS)')
+        parser.add_argument(
+            '--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        tex_dir = tempfile.mkdtemp(prefix='certbench-')
+        overrides = {
+            'DEFAULT_FILE_STORAGE': 'iotaProject.bench.InMemoryStorage',
+            'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+            'CERTIFICATE_TEX_DIR': tex_dir,
+            'CERTIFICATE_TEX_WORKERS': options['tex_workers'] or
+                getattr(settings, 'CERTIFICATE_TEX_WORKERS', 2),
+        }
+        if options['tex'] == 'stub':
+            overrides['CERTIFICATE_PDFLATEX'] = bench.STUB_PDFLATEX
+
+        results = []
+        try:
+            with override_settings(**overrides):
+                for operation in options['operations']:
+                    for concurrency in options['concurrency']:
+                        result = bench.isolated(
+                            bench.run_operation,
+                            (operation, concurrency, options['iterations']))
+                        results.append(result)
+                        self.stdout.write(
+                            '{0:>9} x{1:<3} p50 {2:8.1f} ms p99 {3:8.1f} ms '
+                            '{4:7.2f}/s {5:8d} kB peak RSS'.format(
+                                operation, concurrency,
+                                result['latency_ms']['p50'],
+                                result['latency_ms']['p99'],
+                                result['throughput_per_s'],
+                                result['peak_rss_kb']))
+        finally:
+            shutil.rmtree(tex_dir, ignore_errors=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as dest:
+                json.dump({
+                    'tex': options['tex'],
+                    'compositing': getattr(
+                        settings, 'CERTIFICATE_COMPOSITING', False),
+                    'tex_workers': overrides['CERTIFICATE_TEX_WORKERS'],
+                    'iterations': options['iterations'],
+                    'results': results,
+                }, dest, indent=2, sort_keys=True)
@@ -0,0 +1,34 @@
+""" teamiota/management/commands/benchmark_thumbnails.py """
+
+from django.core.management.base import BaseCommand
+from iotaProject import certs
+from iotaProject.bench import measure
+
+class Command(BaseCommand):
+    """ Compare full-resolution and low-resolution thumbnail rasterization """
+
+    help = ('Rasterize one certificate into a thumbnail at full resolution '
+            'and at the thumbnail resolution, reporting time and memory')
+
+    def add_arguments(self, parser):
+        parser.add_argument('award_id', type=int, help='AwardEvent to render')
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help='Thumbnails rasterized per measurement')
+
+    def handle(self, *args, **options):
+        with certs.Certificate(options['award_id']) as this_cert:
+            pdf_content = this_cert.render(image=False, thumb=False).pdf
+
+        size = (certs.THUMB_WIDTH, certs.THUMB_HEIGHT)
+        for label, resolution in (('full', certs.IMAGE_RESOLUTION),
+                                  ('thumbnail', certs.THUMB_RESOLUTION)):
+            result = measure(
+                certs.rasterize,
+                (pdf_content, resolution, size),
+                options['repeat'])
+            self.stdout.write(
+                '{0:>9} ({1:>3} dpi): {2:8.1f} ms wall {3:8.1f} ms cpu '
+                '{4:8d} kB peak RSS ({5:+d} kB)'.format(
+                    label, resolution, result['wall_ms'], result['cpu_ms'],
+                    result['peak_rss_kb'], result['rss_growth_kb']))
@@ -0,0 +1,36 @@
+""" teamiota/management/commands/certificate_metrics.py """
+
+from django.core.management.base import BaseCommand
+from iotaProject import metrics
+
+class Command(BaseCommand):
+    """ Print certificate pipeline timing percentiles """
+
+    help = ('Print p50/p90/p99/max per certificate pipeline stage and award '
+            'type from the metrics log written by every process')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'logs', nargs='*',
+            help='Log files to read (default: the metrics log and backups)')
+        parser.add_argument(
+            '--samples', type=int, default=metrics.MAX_SAMPLES,
+            help='Most recent spans kept per stage and award type')
+
+    def handle(self, *args, **options):
+        paths = options['logs'] or metrics.log_paths()
+        rows = metrics.read_log(paths, options['samples']).summary()
+        if not rows:
+            self.stdout.write('No spans logged')
+            return
+
+        self.stdout.write('{0:<20} {1:<24} {2:>6} {3:>9} {4:>9} {5:>9} {6:>9}'.
+                          format('stage', 'award type', 'count', 'p50 ms',
+                                 'p90 ms', 'p99 ms', 'max ms'))
+        for row in rows:
+            self.stdout.write(
+                '{0:<20} {1:<24} {2:>6} {3:>9.1f} {4:>9.1f} {5:>9.1f} '
+                '{6:>9.1f}'.format(
+                    row['stage'], row['award_type'] or '-', row['count'],
+                    *[value for _, value in row['percentiles']] +
+                    [row['max']]))
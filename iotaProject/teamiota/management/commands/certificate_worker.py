@@ -0,0 +1,28 @@
+""" teamiota/management/commands/certificate_worker.py """
+
+from django.core.management.base import BaseCommand
+from teamiota import jobs
+
+class Command(BaseCommand):
+    """ Render, store and email queued certificates """
+
+    help = 'Process queued certificate jobs from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to sleep when the queue is empty')
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        try:
+            jobs.run_worker(
+                poll_interval=options['poll_interval'],
+                burst=options['burst'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,30 @@
+""" teamiota/management/commands/collect_artifacts.py """
+
+from django.core.management.base import BaseCommand
+from teamiota import artifacts
+
+class Command(BaseCommand):
+    """ Delete stored files of deleted AwardEvents """
+
+    help = ('Remove recorded orphaned certificate files from storage in '
+            'batches, optionally first finding unreferenced stored files')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Files deleted per pass')
+        parser.add_argument(
+            '--reconcile', action='store_true',
+            help='Record stored artifacts no AwardEvent refers to')
+        parser.add_argument(
+            '--grace', type=int, default=artifacts.RECONCILE_GRACE,
+            help='Seconds before files found by --reconcile are deleted')
+
+    def handle(self, *args, **options):
+        if options['reconcile']:
+            found = artifacts.reconcile(options['grace'])
+            self.stdout.write(
+                'Recorded {0} unreferenced files'.format(found))
+
+        collected = artifacts.collect_all(options['batch_size'])
+        self.stdout.write('Collected {0} files'.format(collected))
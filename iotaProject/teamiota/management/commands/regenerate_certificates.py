@@ -0,0 +1,185 @@
+""" teamiota/management/commands/regenerate_certificates.py """
+
+import os
+import json
+import time
+from multiprocessing import Pool
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.dateparse import parse_date
+from teamiota.models import AwardEvent
+from teamiota import jobs
+
+def _init_worker():
+    """ Prepare a pool process: set up Django and drop inherited connections """
+
+    django.setup()
+    connections.close_all()
+
+def _regenerate(award_id):
+    """ Regenerate one thumbnail; return (award_id, error or None) """
+
+    try:
+        jobs.regenerate(award_id)
+    # pylint: disable=broad-except
+    except Exception as exception:
+        return award_id, '{0}'.format(exception)
+    return award_id, None
+
+class Command(BaseCommand):
+    """ Regenerate stored certificate thumbnails in parallel """
+
+    help = ('Re-render AwardEvent thumbnails after award.tex or an award '
+            'colour changes. Awards whose certificate job has not finished '
+            'are left to it. Progress is checkpointed so an interrupted run '
+            'resumes where it stopped, retrying awards that failed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--award-type', help='Award id or name to limit regeneration to')
+        parser.add_argument(
+            '--from-date', help='Only awards on or after YYYY-MM-DD')
+        parser.add_argument(
+            '--to-date', help='Only awards on or before YYYY-MM-DD')
+        parser.add_argument(
+            '--department', help='Awardee department id or name')
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Number of render processes')
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help='Awards rendered between checkpoints')
+        parser.add_argument(
+            '--checkpoint', default='regenerate_certificates.json',
+            help='File recording progress for resuming')
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore an existing checkpoint and start over')
+
+    # Helper method for building the AwardEvent queryset from the filters
+    @staticmethod
+    def __queryset(options):
+        # Pending and running jobs render their own thumbnail, and still have
+        # to send their email
+        events = AwardEvent.objects.filter(certStatus=AwardEvent.CERT_DONE)
+
+        if options['award_type']:
+            if options['award_type'].isdigit():
+                events = events.filter(awardType=int(options['award_type']))
+            else:
+                events = events.filter(
+                    awardType__awardType=options['award_type'])
+
+        for option, lookup in (('from_date', 'dateOfAward__gte'),
+                               ('to_date', 'dateOfAward__lte')):
+            if options[option]:
+                value = parse_date(options[option])
+                if value is None:
+                    raise CommandError(
+                        'Invalid date for --{0}: {1}'.format(
+                            option.replace('_', '-'), options[option]))
+                events = events.filter(**{lookup: value})
+
+        if options['department']:
+            if options['department'].isdigit():
+                events = events.filter(
+                    awardee__department=int(options['department']))
+            else:
+                events = events.filter(
+                    awardee__department__name=options['department'])
+
+        return events
+
+    # Helper method for loading a checkpoint written with the same filters
+    def __load_checkpoint(self, path, filters, restart):
+        if restart or not os.path.exists(path):
+            return {'filters': filters, 'last_id': 0, 'done': 0, 'failed': []}
+
+        with open(path) as src:
+            checkpoint = json.load(src)
+        if checkpoint.get('filters') != filters:
+            raise CommandError(
+                'Checkpoint {0} was written with different filters; '
+                'use --restart to discard it'.format(path))
+
+        self.stdout.write(
+            'Resuming after AwardEvent {0} ({1} done, retrying {2} '
+            'failed)'.format(checkpoint['last_id'], checkpoint['done'],
+                             len(checkpoint['failed'])))
+        return checkpoint
+
+    @staticmethod
+    def __save_checkpoint(path, checkpoint):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as dest:
+            json.dump(checkpoint, dest)
+        os.replace(temp_path, path)
+
+    def handle(self, *args, **options):
+        filters = {
+            key: options[key]
+            for key in ('award_type', 'from_date', 'to_date', 'department')
+        }
+        path = options['checkpoint']
+        checkpoint = self.__load_checkpoint(path, filters, options['restart'])
+
+        events = self.__queryset(options)
+        # Awards that failed in an earlier run are retried first
+        award_ids = list(events.
+                         filter(id__in=checkpoint['failed']).
+                         order_by('id').
+                         values_list('id', flat=True))
+        checkpoint['failed'] = award_ids[:]
+        award_ids += list(events.
+                          filter(id__gt=checkpoint['last_id']).
+                          order_by('id').
+                          values_list('id', flat=True))
+        remaining = len(award_ids)
+        self.stdout.write('{0} certificates to regenerate'.format(remaining))
+        if not remaining:
+            return
+
+        # Forked pool processes must not share this process's connection
+        connections.close_all()
+
+        started = time.time()
+        done = 0
+        with Pool(options['processes'], initializer=_init_worker) as pool:
+            for start in range(0, remaining, options['batch_size']):
+                batch = award_ids[start:start + options['batch_size']]
+
+                # Batches complete in id order, so everything up to the last
+                # id of a finished batch is safe to skip on resume; failures
+                # are kept in the checkpoint to retry
+                failed = []
+                for award_id, error in pool.imap_unordered(_regenerate, batch):
+                    if error is not None:
+                        failed.append(award_id)
+                        self.stderr.write('AwardEvent {0}: {1}'.format(
+                            award_id, error))
+                retried = set(batch)
+                checkpoint['failed'] = [
+                    award_id for award_id in checkpoint['failed']
+                    if award_id not in retried
+                ] + failed
+                done += len(batch)
+                checkpoint['done'] += len(
+                    [award_id for award_id in batch
+                     if award_id > checkpoint['last_id']])
+                checkpoint['last_id'] = max(checkpoint['last_id'], batch[-1])
+                self.__save_checkpoint(path, checkpoint)
+
+                elapsed = time.time() - started
+                self.stdout.write(
+                    '{0}/{1} regenerated, {2:.1f} certificates/s'.format(
+                        done, remaining, done / elapsed if elapsed else 0))
+
+        self.stdout.write(
+            'Finished {0} certificates in {1:.1f}s, {2} failed'.format(
+                done, time.time() - started, len(checkpoint['failed'])))
+        if checkpoint['failed']:
+            self.stdout.write(
+                'Failed AwardEvents, retried by the next run: {0}'.format(
+                    ', '.join(str(award_id)
+                              for award_id in checkpoint['failed'])))
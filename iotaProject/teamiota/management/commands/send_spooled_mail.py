@@ -0,0 +1,52 @@
+""" teamiota/management/commands/send_spooled_mail.py """
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from teamiota import mail
+
+class Command(BaseCommand):
+    """ Send spooled email over one reused connection """
+
+    help = 'Drain the email spool written by SpoolingEmailBackend'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Messages claimed from the spool at a time')
+        parser.add_argument(
+            '--backend',
+            help='Email backend to send through '
+                 '(default: SPOOLED_EMAIL_BACKEND)')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep draining until interrupted, also when the mail '
+                 'server is unreachable')
+        parser.add_argument(
+            '--poll-interval', type=float, default=5.0,
+            help='Seconds to sleep between drains with --loop')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                try:
+                    sent, failed = mail.drain(
+                        options['batch_size'], options['backend'])
+                # pylint: disable=broad-except
+                except Exception as exception:
+                    # drain() handed the messages back; try again later
+                    if not options['loop']:
+                        raise CommandError(
+                            'Could not send spooled email: {0}'.format(
+                                exception))
+                    self.stderr.write(
+                        'Could not send spooled email: {0}'.format(exception))
+                else:
+                    if sent or failed or not options['loop']:
+                        self.stdout.write(
+                            'Sent {0} messages, {1} failed'.format(
+                                sent, failed))
+                if not options['loop']:
+                    return
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
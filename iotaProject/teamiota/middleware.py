@@ -0,0 +1,29 @@
+""" teamiota/middleware.py """
+
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+from teamiota.models import NormalUser
+
+def get_normal_user(request):
+    """ Return the logged in user's NormalUser, or None """
+
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    try:
+        # Joined into the user's query by teamiota.backends.EmailBackend
+        return user.normaluser
+    except NormalUser.DoesNotExist:
+        return None
+
+class NormalUserMiddleware(MiddlewareMixin):
+    """ Set request.normal_user to the logged in user's NormalUser
+
+    It is loaded on first use, together with the user, their department
+    and their location in the one query that loads request.user. Must come
+    after AuthenticationMiddleware.
+    """
+
+    def process_request(self, request):
+        request.normal_user = SimpleLazyObject(
+            lambda: get_normal_user(request))
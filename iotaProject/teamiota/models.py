@@ -1,13 +1,15 @@
 """ teamiota/models.py """
 
 import os
-import shutil
-from django.db import models
+import hashlib
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage as storage
 from django.core.urlresolvers import reverse
 from django.dispatch.dispatcher import receiver
+from django.utils import timezone
 
 from iotaProject import settings
 
@@ -71,42 +73,95 @@ class NormalUser(models.Model):
         null=True,
         blank=True)
 
-    def save(self, **kwargs):
+    # sha256 of the signature as uploaded, before resizing
+    signatureHash = models.CharField(max_length=64, blank=True, default='')
+
+    def save(self, *args, **kwargs):
         """ Save uploaded signature as 350X100 png sig.png """
-        super(NormalUser, self).save()
+        update_fields = kwargs.get('update_fields')
         # Check for first and last name
         if not self.nickname or self.nickname == '':
-            # Set initial nickname to first and last name
-            if self.user.first_name or self.user.last_name:
-                self.nickname = '{0} {1}'.format(
-                    self.user.first_name, self.user.last_name)
-            elif self.user.username:
-                self.nickname = self.user.username
-            elif self.user.email:
-                self.nickname = self.user.email.split('@')[0]
-            else:
-                self.nickname = 'Anonymous'
-            self.save(update_fields=['nickname'])
-        if self.pk is not None:
-            # Signature image was submitted for upload
-            if self.signatureImage:
-                with storage.open(self.signatureImage.name, 'rb+') as original:
-                    with open('temp.png', 'wb+') as temp:
-                        shutil.copyfileobj(original, temp)
-
-                with Image(filename='temp.png') as sig:
-                    sig.resize(350, 100)
-                    sig.format = 'png'
-                    sig.save(filename='temp.png')
-
-                with storage.open(self.signatureImage.name, 'wb+') as resized:
-                    with open('temp.png', 'rb+') as temp:
-                        shutil.copyfileobj(temp, resized)
-                os.remove('temp.png')
+            self.nickname = self.default_nickname(self.user)
+            if update_fields is not None:
+                update_fields = set(update_fields) | {'nickname'}
+        # Signature image was submitted for upload
+        if self.__process_signature() and update_fields is not None:
+            update_fields = set(update_fields) | {
+                'signatureImage', 'signatureHash'}
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
+        super(NormalUser, self).save(*args, **kwargs)
+
+    @staticmethod
+    def default_nickname(user):
+        """ Initial nickname for a User: first and last name if set """
+
+        if user.first_name or user.last_name:
+            return '{0} {1}'.format(user.first_name, user.last_name)
+        elif user.username:
+            return user.username
+        elif user.email:
+            return user.email.split('@')[0]
+        return 'Anonymous'
+
+    # Resize a newly uploaded signature in memory so the ImageField writes
+    # it to storage once. Returns True if the signature fields changed.
+    def __process_signature(self):
+        upload = self.signatureImage
+        # pylint: disable=protected-access
+        if not upload or upload._committed:
+            # No signature, or the one already in storage
+            return False
+
+        content = b''.join(upload.chunks())
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        if self.pk is not None and content_hash == self.signatureHash:
+            stored_name = NormalUser.objects.\
+                filter(pk=self.pk).\
+                values_list('signatureImage', flat=True).first()
+            if stored_name and storage.exists(stored_name):
+                # Same image uploaded again; keep the stored file
+                self.signatureImage = stored_name
+                return True
+
+        with Image(blob=content) as sig:
+            sig.resize(350, 100)
+            sig.format = 'png'
+            self.signatureImage = ContentFile(sig.make_blob(), 'sig.png')
+        self.signatureHash = content_hash
+        return True
 
     def __str__(self):
         return self.user.email
 
+@receiver(models.signals.pre_save, sender=NormalUser)
+@receiver(models.signals.pre_delete, sender=NormalUser)
+def signature_changed(sender, instance, **kwargs):
+    """ Drop a replaced or deleted signature from the signature cache """
+
+    # Imported here: certs imports this module
+    from iotaProject import certs
+
+    update_fields = kwargs.get('update_fields')
+    if instance.pk is None or (
+            update_fields is not None and
+            'signatureImage' not in update_fields and
+            'signatureHash' not in update_fields):
+        return
+    stored = NormalUser.objects.\
+        filter(pk=instance.pk).\
+        values_list('signatureImage', 'signatureHash').first()
+    if stored is None or not stored[1]:
+        return
+
+    # Saves that keep the signature keep its cache entry
+    unchanged = (stored[0] == instance.signatureImage.name and
+                 stored[1] == instance.signatureHash)
+    if kwargs['signal'] is models.signals.pre_save and unchanged:
+        return
+    certs.get_signature_cache().delete(certs.signature_cache_key(*stored))
+
 class Award(models.Model):
     """ A Certificate """
 
@@ -116,15 +171,77 @@ class Award(models.Model):
     def __str__(self):
         return self.awardType
 
+@receiver(models.signals.pre_save, sender=Award)
+@receiver(models.signals.pre_delete, sender=Award)
+def award_changed(sender, instance, **kwargs):
+    """ Delete the cached certificate background of an edited Award """
+
+    # Imported here: compositing imports this module through certs
+    from iotaProject import compositing
+
+    if instance.pk is None:
+        return
+    try:
+        stored = Award.objects.get(pk=instance.pk)
+    except Award.DoesNotExist:
+        return
+
+    # Saves that leave the certificate unchanged keep their background
+    unchanged = (stored.awardType == instance.awardType and
+                 stored.awardTemplate == instance.awardTemplate)
+    if kwargs['signal'] is models.signals.pre_save and unchanged:
+        return
+    compositing.invalidate(stored.awardType, stored.awardTemplate)
+
+# Storage folder for certificate thumbnails
+CERT_THUMB_LOCATION = 'teamiota/certThumbs'
+
 def ae_path(instance, filename):
-    """ Generate filepath for a certificate image """
+    """ Generate filepath for a certificate image
 
-    retval = 'teamiota/certThumbs/{0}.{1}'.format(instance.id, 'png')
+    filename is a content hash, so a changed thumbnail gets a new name and
+    a stored thumbnail never changes.
+    """
+
+    retval = '{0}/{1}-{2}'.format(CERT_THUMB_LOCATION, instance.id, filename)
     return retval
 
+def thumb_name(content):
+    """ Content-hashed file name for ae_path of thumbnail bytes """
+
+    return '{0}.png'.format(hashlib.sha256(content).hexdigest()[:16])
+
+class AwardEventQuerySet(models.QuerySet):
+    """ AwardEvent queries """
+
+    def delete(self):
+        """ Delete the rows, recording their stored artifacts for collection """
+
+        # Imported here: artifacts imports this module through certs
+        from teamiota import artifacts
+
+        with transaction.atomic(using=self.db):
+            artifacts.record(self)
+            return super(AwardEventQuerySet, self).delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
 class AwardEvent(models.Model):
     """ Meta Data for an instance of an Award being awarded """
 
+    # Certificate job states, see teamiota.jobs
+    CERT_PENDING = 'pending'
+    CERT_RUNNING = 'running'
+    CERT_DONE = 'done'
+    CERT_FAILED = 'failed'
+    CERT_STATUS_CHOICES = (
+        (CERT_PENDING, 'Pending'),
+        (CERT_RUNNING, 'Running'),
+        (CERT_DONE, 'Done'),
+        (CERT_FAILED, 'Failed'),
+    )
+
     awarder = models.ForeignKey(
         NormalUser,
         related_name='awardER',
@@ -137,6 +254,29 @@ class AwardEvent(models.Model):
     awardType = models.ForeignKey(Award, on_delete=models.CASCADE)
     dateOfAward = models.DateField()
     certThumbnail = models.ImageField(upload_to=ae_path, null=True)
+    certStatus = models.CharField(
+        max_length=10,
+        choices=CERT_STATUS_CHOICES,
+        default=CERT_DONE,
+        db_index=True)
+    certAttempts = models.IntegerField(default=0)
+    certRunAfter = models.DateTimeField(null=True, blank=True)
+    certLockedAt = models.DateTimeField(null=True, blank=True)
+    certError = models.TextField(blank=True, default='')
+    # Content hash naming the full-sized PNG and PDF, see certs.get_cached
+    certKey = models.CharField(max_length=64, blank=True, default='')
+
+    objects = AwardEventQuerySet.as_manager()
+
+    def delete(self, *args, **kwargs):
+        """ Delete the row, recording its stored artifacts for collection """
+
+        # Imported here: artifacts imports this module through certs
+        from teamiota import artifacts
+
+        with transaction.atomic(using=kwargs.get('using')):
+            artifacts.record(AwardEvent.objects.filter(pk=self.pk))
+            return super(AwardEvent, self).delete(*args, **kwargs)
 
     def get_absolute_url(self):
         """ AwardEvent URL opens dialog with apropriate image and links """
@@ -150,6 +290,22 @@ class AwardEvent(models.Model):
                    self.awardType.awardType,
                    self.awardee.user.email)
 
+class SpooledEmail(models.Model):
+    """ An outgoing email waiting to be sent, see teamiota.mail """
+
+    # The serialized message and its envelope
+    message = models.BinaryField()
+    fromEmail = models.TextField()
+    recipients = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    sendAfter = models.DateTimeField(db_index=True)
+    attempts = models.IntegerField(default=0)
+    claimToken = models.CharField(max_length=32, blank=True, default='')
+    lastError = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return 'Spooled email {0}'.format(self.id)
+
 # Create a NormalUser on new User object
 def create_normal_user(sender, instance, created, **kwargs):
     """ Automatically generate NormalUser on new User """
@@ -160,15 +316,27 @@ def create_normal_user(sender, instance, created, **kwargs):
 # Attach post_save event handler to User save
 models.signals.post_save.connect(create_normal_user, sender=User)
 
-# pylint: disable=line-too-long
-# src: http://stackoverflow.com/questions/5372934/how-do-i-get-django-admin-to-delete-files-when-i-remove-an-object-from-the-datab
-@receiver(models.signals.pre_delete, sender=AwardEvent)
-def mymodel_delete(sender, instance, **kwargs):
-    """ Delete certificate thumbnail on AwardEvent deletion """
-
-    if os.path.exists(os.path.join(settings.MEDIA_ROOT, str(instance.id) + '.pdf')):
-        os.remove(os.path.join(settings.MEDIA_ROOT, str(instance.id) + '.pdf'))
-    if os.path.exists(os.path.join(settings.MEDIA_ROOT, str(instance.id) + '.png')):
-        os.remove(os.path.join(settings.MEDIA_ROOT, str(instance.id) + '.png'))
-    # Pass false so FileField doesn't save the model.
-    instance.certThumbnail.delete(False)
+class OrphanedArtifact(models.Model):
+    """ A stored certificate file of a deleted AwardEvent, see teamiota.artifacts """
+
+    name = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+    collectAfter = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.name
+
+@receiver(models.signals.pre_delete, sender=NormalUser)
+@receiver(models.signals.pre_delete, sender=Award)
+def award_events_cascaded(sender, instance, **kwargs):
+    """ Record artifacts of AwardEvents deleted along with a user or Award """
+
+    # Imported here: artifacts imports this module through certs
+    from teamiota import artifacts
+
+    if sender is Award:
+        award_events = AwardEvent.objects.filter(awardType=instance)
+    else:
+        award_events = AwardEvent.objects.filter(
+            models.Q(awarder=instance) | models.Q(awardee=instance))
+    artifacts.record(award_events)
@@ -0,0 +1,54 @@
+""" teamiota/sessions.py
+
+Cached, database-backed sessions with a short-lived cache tier. Use with
+SESSION_ENGINE = 'teamiota.sessions'. Sessions are read from the cache
+named by SESSION_CACHE_ALIAS and only go to the database on a miss; every
+save and delete goes to both, so logout() removes the session from the
+cache as well as the database.
+
+The cache must be shared by every server, such as memcached, or the
+deployment must be a single host whose processes share a FileBasedCache:
+a server with its own cache would keep accepting a session logged out on
+another one until its copy expires, after at most SESSION_CACHE_TTL
+seconds. iotaProject.settings only enables this engine in those cases.
+"""
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as \
+    CachedDBStore
+
+# Seconds a session stays in the cache tier when SESSION_CACHE_TTL is unset
+DEFAULT_CACHE_TTL = 60
+
+class CappedCache():
+    """ A cache whose entries expire after at most ttl seconds """
+
+    def __init__(self, cache, ttl):
+        self.cache = cache
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        return self.cache.get(key, default)
+
+    def set(self, key, value, timeout):
+        # A timeout of None would keep the entry forever
+        if timeout is None or timeout > self.ttl:
+            timeout = self.ttl
+        self.cache.set(key, value, timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def __contains__(self, key):
+        return key in self.cache
+
+class SessionStore(CachedDBStore):
+    """ Django's cached_db sessions, cached for SESSION_CACHE_TTL seconds """
+
+    cache_key_prefix = 'teamiota.sessions'
+
+    def __init__(self, session_key=None):
+        super(SessionStore, self).__init__(session_key)
+        self._cache = CappedCache(
+            self._cache,
+            getattr(settings, 'SESSION_CACHE_TTL', DEFAULT_CACHE_TTL))
@@ -0,0 +1,360 @@
+""" teamiota/tests.py """
+
+import os
+import shutil
+import hashlib
+import tempfile
+from datetime import date
+from unittest import mock
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core import mail as django_mail
+from django.core.cache import caches
+from django.core.mail import EmailMessage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from teamiota import mail
+from teamiota.models import (
+    Award, AwardEvent, Department, Location, SpooledEmail)
+from teamiota.sessions import CappedCache, SessionStore
+
+# Awards given to and by the busy user
+AWARD_COUNT = 25
+
+# force_login needs a backend when several are configured
+LOGIN_BACKEND = 'teamiota.backends.EmailBackend'
+
+LOCAL_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'teamiota-tests-default',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'teamiota-tests-sessions',
+    },
+}
+
+def make_normal_user(username, department, location):
+    """ Create a User and return their NormalUser """
+
+    user = User.objects.create_user(
+        username, '{0}@example.com'.format(username), 'password')
+    normal_user = user.normaluser
+    normal_user.department = department
+    normal_user.location = location
+    normal_user.save()
+    return normal_user
+
+@override_settings(CACHES=LOCAL_CACHES)
+class NormalUsersPortalQueriesTest(TestCase):
+    """ NormalUsersPortal runs as many queries however many awards a user has """
+
+    @classmethod
+    def setUpTestData(cls):
+        department = Department.objects.create(name='Engineering')
+        location = Location.objects.create(name='Corvallis')
+        cls.award = Award.objects.create(
+            awardType='Team Player', awardTemplate='award.tex')
+        cls.new_user = make_normal_user('new', department, location)
+        cls.busy_user = make_normal_user('busy', department, location)
+        cls.colleague = make_normal_user('colleague', department, location)
+
+        award_events = []
+        for day in range(1, AWARD_COUNT + 1):
+            award_events.append(AwardEvent(
+                awarder=cls.colleague, awardee=cls.busy_user,
+                awardType=cls.award, dateOfAward=date(2017, 1, day % 28 + 1)))
+            award_events.append(AwardEvent(
+                awarder=cls.busy_user, awardee=cls.colleague,
+                awardType=cls.award, dateOfAward=date(2017, 2, day % 28 + 1)))
+        AwardEvent.objects.bulk_create(award_events)
+
+    def setUp(self):
+        self.url = reverse('normalUsersPortal')
+
+    def count_queries(self, normal_user, request):
+        """ Log in as normal_user and count the queries of request() """
+
+        self.client.force_login(normal_user.user, LOGIN_BACKEND)
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def award_form(self, normal_user):
+        """ POST data for a new award from normal_user to the colleague """
+
+        return {
+            'newAwardForm': 'Submit',
+            'awarder': normal_user.id,
+            'awardee': self.colleague.id,
+            'awardType': self.award.id,
+            'dateOfAward': '2017-03-01',
+        }
+
+    def test_get_queries_do_not_grow_with_awards(self):
+        # Warm up per-process caches so both counts start from the same state
+        self.count_queries(self.new_user, lambda: self.client.get(self.url))
+
+        expected = self.count_queries(
+            self.new_user, lambda: self.client.get(self.url))
+        self.client.force_login(self.busy_user.user, LOGIN_BACKEND)
+        with self.assertNumQueries(expected):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_queries_do_not_grow_with_awards(self):
+        self.count_queries(self.new_user, lambda: self.client.get(self.url))
+
+        expected = self.count_queries(
+            self.new_user,
+            lambda: self.client.post(self.url, self.award_form(self.new_user)))
+        self.client.force_login(self.busy_user.user, LOGIN_BACKEND)
+        with self.assertNumQueries(expected):
+            response = self.client.post(
+                self.url, self.award_form(self.busy_user))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            AwardEvent.objects.filter(
+                awardee=self.colleague, dateOfAward=date(2017, 3, 1)).count(),
+            2)
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    SESSION_ENGINE='teamiota.sessions',
+    SESSION_CACHE_ALIAS='sessions',
+    SESSION_CACHE_TTL=60)
+class SessionStoreTest(TestCase):
+    """ teamiota.sessions in front of a local memory cache """
+
+    def setUp(self):
+        caches['sessions'].clear()
+
+    def saved_session(self, **data):
+        """ Save a new session holding data and return its key """
+
+        session = SessionStore()
+        session.update(data)
+        session.save()
+        return session.session_key
+
+    def is_cached(self, session_key):
+        """ Whether the sessions cache holds session_key """
+
+        return SessionStore.cache_key_prefix + session_key in caches['sessions']
+
+    def test_warm_load_skips_database(self):
+        session_key = self.saved_session(color='blue')
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(session_key)['color'], 'blue')
+
+    def test_cold_load_reads_database_once(self):
+        session_key = self.saved_session(color='blue')
+        caches['sessions'].clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(SessionStore(session_key)['color'], 'blue')
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(session_key)['color'], 'blue')
+
+    def test_flush_removes_cache_and_database_rows(self):
+        session_key = self.saved_session(color='blue')
+        SessionStore(session_key).flush()
+        self.assertFalse(self.is_cached(session_key))
+        self.assertFalse(
+            Session.objects.filter(session_key=session_key).exists())
+        self.assertNotIn('color', SessionStore(session_key))
+
+    def logout_removes_session(self, url):
+        """ Log in, request a logout url and check the session is gone """
+
+        user = User.objects.create_user('leaving', 'leaving@example.com', 'pw')
+        self.client.force_login(user, LOGIN_BACKEND)
+        session_key = self.client.session.session_key
+        self.assertTrue(self.is_cached(session_key))
+
+        self.client.get(url)
+        self.assertFalse(self.is_cached(session_key))
+        self.assertFalse(
+            Session.objects.filter(session_key=session_key).exists())
+
+    def test_logout_view_removes_session(self):
+        self.logout_removes_session(reverse('normalUserLogout'))
+
+    def test_administrator_logout_removes_session(self):
+        self.logout_removes_session('/administrator/logout/')
+
+    def test_cache_entries_expire_within_ttl(self):
+        timeouts = []
+
+        class RecordingCache():
+            """ Records the timeouts entries are set with """
+
+            def set(self, key, value, timeout):
+                timeouts.append(timeout)
+
+        capped = CappedCache(RecordingCache(), 60)
+        capped.set('a', {}, 14 * 24 * 60 * 60)
+        capped.set('b', {}, None)
+        capped.set('c', {}, 30)
+        self.assertEqual(timeouts, [60, 60, 30])
+
+class FileSessionCacheTest(TestCase):
+    """ teamiota.sessions in front of the settings' FileBasedCache """
+
+    MAX_ENTRIES = 5
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, True)
+        settings = override_settings(
+            CACHES=dict(LOCAL_CACHES, sessions={
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.folder,
+                'OPTIONS': {'MAX_ENTRIES': self.MAX_ENTRIES},
+            }),
+            SESSION_CACHE_ALIAS='sessions',
+            SESSION_CACHE_TTL=60)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def saved_session(self, **data):
+        """ Save a new session holding data and return its key """
+
+        session = SessionStore()
+        session.update(data)
+        session.save()
+        return session.session_key
+
+    def test_warm_load_skips_database(self):
+        session_key = self.saved_session(color='green')
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(session_key)['color'], 'green')
+
+    def test_entries_stay_within_max_entries(self):
+        session_keys = [self.saved_session(number=number)
+                        for number in range(4 * self.MAX_ENTRIES)]
+        cached = [name for name in os.listdir(self.folder)
+                  if name.endswith('.djcache')]
+        self.assertLessEqual(len(cached), self.MAX_ENTRIES)
+
+        # Culled sessions are still read from the database
+        self.assertEqual(SessionStore(session_keys[0])['number'], 0)
+
+    def test_flush_removes_cache_and_database_rows(self):
+        session_key = self.saved_session(color='green')
+        SessionStore(session_key).flush()
+        self.assertNotIn(
+            SessionStore.cache_key_prefix + session_key, caches['sessions'])
+        self.assertFalse(
+            Session.objects.filter(session_key=session_key).exists())
+
+class UnreachableBackend(BaseEmailBackend):
+    """ An email backend whose server refuses connections """
+
+    def open(self):
+        raise ConnectionRefusedError('Connection refused')
+
+    def send_messages(self, email_messages):
+        raise AssertionError('Sent without a connection')
+
+class DroppingBackend(UnreachableBackend):
+    """ An email backend whose server drops the first message and goes away """
+
+    def open(self):
+        if SpooledEmail.objects.filter(attempts__gt=0).exists():
+            super(DroppingBackend, self).open()
+
+    def send_messages(self, email_messages):
+        raise ConnectionResetError('Connection reset')
+
+@override_settings(EMAIL_BACKEND='teamiota.mail.SpoolingEmailBackend')
+class SpooledMailTest(TestCase):
+    """ teamiota.mail stores messages and sends them with send_spooled_mail """
+
+    def spool(self, count=1):
+        """ Send count messages through the spooling backend """
+
+        for number in range(count):
+            message = EmailMessage(
+                'Certificat n\xb0{0}'.format(number), 'F\xe9licitations',
+                'awards@example.com', ['winner@example.com'],
+                bcc=['records@example.com'])
+            message.attach('certificate.pdf', b'%PDF-1.4', 'application/pdf')
+            message.send()
+
+    def test_drain_sends_stored_messages(self):
+        self.spool()
+        self.assertEqual(
+            mail.drain(backend='django.core.mail.backends.locmem.EmailBackend'),
+            (1, 0))
+        self.assertFalse(SpooledEmail.objects.exists())
+
+        sent, = django_mail.outbox
+        self.assertEqual(sent.from_email, 'awards@example.com')
+        self.assertEqual(
+            sent.recipients(), ['winner@example.com', 'records@example.com'])
+        message = sent.message()
+        self.assertNotIn('Bcc', message)
+        self.assertIn(
+            b'F\xc3\xa9licitations', message.as_bytes(linesep='\r\n'))
+        attachment = message.get_payload()[1]
+        self.assertEqual(attachment.get_payload(decode=True), b'%PDF-1.4')
+
+    def test_unreachable_server_keeps_attempts(self):
+        self.spool(3)
+        with self.assertRaises(ConnectionRefusedError):
+            mail.drain(backend='teamiota.tests.UnreachableBackend')
+        self.assertEqual(
+            list(SpooledEmail.objects.values_list('attempts', 'claimToken')),
+            [(0, '')] * 3)
+
+    def test_lost_connection_releases_untried_messages(self):
+        self.spool(3)
+        with self.assertRaises(ConnectionRefusedError):
+            mail.drain(backend='teamiota.tests.DroppingBackend')
+
+        spooled = list(SpooledEmail.objects.order_by('id'))
+        self.assertEqual([row.attempts for row in spooled], [1, 0, 0])
+        self.assertEqual([row.claimToken for row in spooled], [''] * 3)
+        self.assertEqual(spooled[0].lastError, 'Connection reset')
+        self.assertEqual(spooled[1].lastError, 'Connection refused')
+
+class ArtifactViewTest(TestCase):
+    """ ArtifactView answers from the name or redirects to storage """
+
+    NAME = 'teamiota/certThumbs/1-0123456789abcdef.png'
+
+    def get(self, name=NAME, **headers):
+        """ GET the artifact name, recording storage calls """
+
+        with mock.patch('teamiota.views.storage') as storage:
+            storage.url.return_value = '/media/' + name
+            response = self.client.get(
+                reverse('artifact', args=[name]), **headers)
+        return response, storage
+
+    def test_matching_etag_skips_storage(self):
+        etag = hashlib.sha1(self.NAME.encode('utf-8')).hexdigest()
+        response, storage = self.get(
+            HTTP_IF_NONE_MATCH='"{0}"'.format(etag),
+            HTTP_IF_MODIFIED_SINCE='Thu, 01 Jan 1970 00:00:00 GMT')
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertFalse(storage.mock_calls)
+
+    def test_redirects_to_storage(self):
+        response, storage = self.get(HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], '/media/' + self.NAME)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(storage.mock_calls, [mock.call.url(self.NAME)])
+
+    def test_other_media_not_found(self):
+        response, storage = self.get('teamiota/signatures/1.png')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(storage.mock_calls)
@@ -20,7 +20,11 @@ urlpatterns = [
     url(r'^NormalUsersPortal/', views.NormalUsersPortal.as_view(), name='normalUsersPortal'),
     url(r'^login/', views.LoginView.as_view(), name='normalUserLogin'),
     url(r'^logout/', views.LogoutView.as_view(), name='normalUserLogout'),
+    url(r'^awards/$', views.AwardGridView.as_view(), name='awardGrid'),
     url(r'^award/(?P<pk>[0-9]+)/', views.AwardView.as_view(), name='awardView'),
+    url(r'^artifacts/(?P<name>.+)$',
+        views.ArtifactView.as_view(),
+        name='artifact'),
     url(r'^revoke/', views.RevokeView.as_view(), name='revokeView'),
     url(r'^DrawnSigSubmitted/',
         views.DrawnSigSubmitted.as_view(),
@@ -1,20 +1,23 @@
 """ teamiota.views.py """
 
-import os
-import shutil
+import hashlib
 from django.shortcuts import render
 from django.contrib.auth import login, logout
-from django.http import HttpResponseRedirect
+from django.db.models import Count
+from django.http import HttpResponseRedirect, HttpResponseNotModified, \
+    Http404, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from django.views.generic import View
 from django.views.generic.detail import DetailView
 from django.core.urlresolvers import reverse
-from django.core.files import File
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage as storage
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from teamiota.models import NormalUser, AwardEvent
+from teamiota.models import AwardEvent, CERT_THUMB_LOCATION
+from teamiota import jobs
 import administrator
-from iotaProject.certs import Certificate
-from iotaProject import settings
+from iotaProject.certs import Certificate, CACHE_LOCATION
 from .forms import NormalUserLoginForm, NormalUserEditForm, NewAwardForm
 
 def index(request):
@@ -30,42 +33,50 @@ class NormalUsersPortal(LoginRequiredMixin, UserPassesTestMixin, View):
     login_url = '/teamiota/login/'
     redirect_field_name = 'normalUsersPortal'
     titleText = 'Employee Recognition'
-    context = {'titleText' : titleText, }
 
     def test_func(self):
         """ Test for UserPassesTestMixin """
         
-        return not self.request.user.normaluser.isAdmin
+        normal_user = self.request.normal_user
+        return bool(normal_user) and not normal_user.isAdmin
+
+    def get_context(self, normal_user, edit_form, new_award_form, **kwargs):
+        """ Build this request's template context
+
+        The page runs a fixed number of queries however many awards the
+        user has: awards are loaded by the award grid from AwardGridView,
+        and the NormalUser is request.normal_user, loaded with the user.
+        """
+
+        context = {
+            'titleText': self.titleText,
+            'NormalUser': normal_user,
+            'newAwardForm': new_award_form,
+            'editForm': edit_form,
+            'hasSig': 'true' if normal_user.signatureImage else 'false',
+        }
+        context.update(kwargs)
+        return context
 
     def get(self, request):
         """ Handles GET requests to Normal Users Portal """
 
-        this_normal_user = NormalUser.objects.get(user=request.user)
-        self.context['NormalUser'] = this_normal_user
-        self.context['awardList'] = AwardEvent.objects.\
-                                    filter(awardee=this_normal_user).\
-                                    order_by('awardType')
-        self.context['newAwardForm'] = \
-                                    NewAwardForm(
-                                        initial={'awarder':this_normal_user}
-                                    )
-        self.context['editForm'] = NormalUserEditForm(instance=this_normal_user)
-        if this_normal_user.signatureImage:
-            self.context['hasSig'] = 'true'
-        else:
-            self.context['hasSig'] = 'false'
-        return render(request, 'teamiota/normalUser/home.html', self.context)
+        this_normal_user = request.normal_user
+        context = self.get_context(
+            this_normal_user,
+            NormalUserEditForm(instance=this_normal_user),
+            NewAwardForm(initial={'awarder':this_normal_user}))
+        return render(request, 'teamiota/normalUser/home.html', context)
 
     def post(self, request, *args, **kwargs):
         """ Handles POST requests to Norma Users Portal """
 
-        this_normal_user = NormalUser.objects.get(user=request.user)
-        if this_normal_user.signatureImage:
-            self.context['hasSig'] = 'true'
-        else:
-            self.context['hasSig'] = 'false'
-        self.context['showEdit'] = 'false'
-        self.context['showAwardForm'] = 'false' 
+        this_normal_user = request.normal_user
+        # Read before the edit form, which changes the instance even when
+        # the edit is rejected
+        has_sig = bool(this_normal_user.signatureImage)
+        show_edit = 'false'
+        show_award_form = 'false'
         if 'editForm' in request.POST:
             edit_form = NormalUserEditForm(
                 request.POST,
@@ -75,55 +86,96 @@ class NormalUsersPortal(LoginRequiredMixin, UserPassesTestMixin, View):
             if edit_form.is_valid():
                 edit_form.save()
                 # Update signature check after form save
-                updated_normal_user = NormalUser.objects.get(user=request.user)
-                if updated_normal_user.signatureImage:
-                    self.context['hasSig'] = 'true'
-                else:
-                    self.context['hasSig'] = 'false'
+                has_sig = bool(this_normal_user.signatureImage)
                 edit_form = NormalUserEditForm(instance=this_normal_user)
             else:
-                edit_form = NormalUserEditForm(request.POST)
-                self.context['showEdit'] = 'true'
+                show_edit = 'true'
         else:
             edit_form = NormalUserEditForm(instance=this_normal_user)
            
         if 'newAwardForm' in request.POST:
-            self.context['showAwardForm'] = 'false'
             new_award_form = NewAwardForm(request.POST)
             if new_award_form.is_valid():
-                this_award_event = new_award_form.save()
-
-                # Make a certificate from the newly created AwardEvent
-                this_cert = Certificate(this_award_event.id)
-                thumb_path = this_cert.get_thumb()
-
-                # Save thumbnail to AwardEvent instance
-                with open(thumb_path, 'rb+') as thumb:
-                    this_award_event.certThumbnail = File(thumb)
-                    this_award_event.save()
+                this_award_event = new_award_form.save(commit=False)
 
-                # Delete generated file
-                try:
-                    os.remove(thumb_path)
-                except Exception as exception:
-                    print('{0}'.format(exception))
-
-                # Send congratulatory email
-                this_cert.email()
+                # Render, store and email the certificate in the background
+                jobs.enqueue(this_award_event)
 
             else:
-                self.context['showAwardForm'] = 'true'
+                show_award_form = 'true'
         else:
             new_award_form = NewAwardForm(initial={'awarder':this_normal_user})
 
-        self.context['NormalUser'] = this_normal_user
-        self.context['awardList'] = AwardEvent.objects.\
-                                    filter(awardee=this_normal_user).\
-                                    order_by('awardType')
-        self.context['newAwardForm'] = new_award_form
-        self.context['editForm'] = edit_form
+        context = self.get_context(
+            this_normal_user, edit_form, new_award_form,
+            hasSig='true' if has_sig else 'false',
+            showEdit=show_edit, showAwardForm=show_award_form)
+        return render(request, 'teamiota/normalUser/home.html', context)
+
+# Awards returned per page by AwardGridView, by default and at most
+AWARD_PAGE_SIZE = 12
+MAX_AWARD_PAGE_SIZE = 100
 
-        return render(request, 'teamiota/normalUser/home.html', self.context)
+class AwardGridView(LoginRequiredMixin, View):
+    """ /teamiota/awards/ """
+
+    def get(self, request):
+        """ Handles GET requests for the award grid JSON
+
+        Without parameters, returns the user's award types with the number
+        of awards of each. With type=<Award id>, returns a page of those
+        awards, newest first; pass the returned next value as after to get
+        the following page.
+        """
+
+        normal_user = request.normal_user
+        awards = AwardEvent.objects.filter(awardee=normal_user)
+
+        if 'type' not in request.GET:
+            types = awards.\
+                values('awardType', 'awardType__awardType').\
+                annotate(count=Count('id')).\
+                order_by('awardType')
+            return JsonResponse({'types': [
+                {
+                    'id': row['awardType'],
+                    'name': row['awardType__awardType'],
+                    'count': row['count'],
+                }
+                for row in types
+            ]})
+
+        try:
+            award_type = int(request.GET['type'])
+            after = int(request.GET['after']) if 'after' in request.GET else None
+            limit = max(1, min(int(request.GET.get('limit', AWARD_PAGE_SIZE)),
+                               MAX_AWARD_PAGE_SIZE))
+        except ValueError:
+            raise Http404
+
+        # Keyset pagination on id: pages cost the same however deep they are
+        page = awards.filter(awardType=award_type).order_by('-id')
+        if after is not None:
+            page = page.filter(id__lt=after)
+        page = list(page[:limit + 1])
+
+        rows = []
+        for award in page[:limit]:
+            thumbnail = None
+            if award.certThumbnail:
+                thumbnail = reverse('artifact', args=[award.certThumbnail.name])
+            rows.append({
+                'id': award.id,
+                'url': award.get_absolute_url(),
+                'date': award.dateOfAward.isoformat(),
+                'status': award.certStatus,
+                'thumbnail': thumbnail,
+            })
+
+        return JsonResponse({
+            'awards': rows,
+            'next': page[limit - 1].id if len(page) > limit else None,
+        })
 
 class LoginView(View):
     """ /teamiota/login/ """
@@ -144,7 +196,8 @@ class LoginView(View):
             this_user = form.get_user()
             login(request, this_user)
         if this_user is not None:
-            this_normal_user = NormalUser.objects.get(user=this_user)
+            # Loaded with the user by the authentication backend
+            this_normal_user = this_user.normaluser
             if this_normal_user.isAdmin:
                 return HttpResponseRedirect(
                     reverse(
@@ -171,7 +224,7 @@ class RevokeView(View):
     def get(self, request):
         """ Handles GET requests for Normal User Revoke View """
 
-        this_normal_user = NormalUser.objects.get(user=request.user)
+        this_normal_user = request.normal_user
         to_delete = AwardEvent.objects.filter(awarder=this_normal_user)
         to_delete.delete()
         return HttpResponseRedirect(reverse('normalUsersPortal'))
@@ -184,10 +237,9 @@ class DrawnSigSubmitted(View):
     def post(self, request, *args, **kwargs):
         """ Handles POST requests for the Normal Users Sig Submission view """
 
-        this_normal_user = NormalUser.objects.get(user=request.user)
+        this_normal_user = request.normal_user
         pic = self.request.POST['imgOutput'].split('data:image/png;base64,')[1]
         from base64 import b64decode
-        from django.core.files.base import ContentFile
         image_data = b64decode(pic)
         this_normal_user.signatureImage = ContentFile(image_data, 'sig.png')
         this_normal_user.save()
@@ -201,47 +253,61 @@ class AwardView(DetailView):
 
     def get_context_data(self, **kwargs):
         """ Append to the context_data of AwardEvent """
-        this_cert = Certificate(self.object.id)
+        # Full-sized certificate image and PDF, rendered on first view only
+        with Certificate(self.object.id) as this_cert:
+            key = this_cert.cache_key()
+            img_name, pdf_name = this_cert.get_cached(key)
 
-        # Generate full-sized certificate image for display
-        src_img_path = this_cert.get_image()
-        src_pdf_path = this_cert.get_pdf()
-
-        # Copy full-sized image to /media/<AwardEvent.id>.png
-        dest_img_path = settings.MEDIA_ROOT + '/' + str(self.object.id) + '.png'
-        dest_pdf_path = settings.MEDIA_ROOT + '/' + str(self.object.id) + '.pdf'
-
-        dest_img_path = str(self.object.id) + '.png'
-        dest_pdf_path = str(self.object.id) + '.pdf'
-
-        # Special handling for Windows test environments
-        if os.name == 'nt':
-            dest_img_path = dest_img_path.replace('\\', '/')
-            dest_pdf_path = dest_pdf_path.replace('\\', '/')
-
-        with open(src_img_path, 'rb+') as src, \
-             storage.open(dest_img_path, 'wb+') as dest:
-            try:
-                shutil.copyfileobj(src, dest)
-            except Exception as exception:
-                print('{0}'.format(exception))
-
-        # Remove generated image
-        os.remove(src_img_path)
-
-        with open(src_pdf_path, 'rb+') as src, \
-             storage.open(dest_pdf_path, 'wb+') as dest:
-            try:
-                shutil.copyfileobj(src, dest)
-            except Exception as exception:
-                print('{0}'.format(exception))
-
-        # Remove generated pdf
-        os.remove(src_pdf_path)
+        # Record the key so deleting the award can collect its files
+        if self.object.certKey != key:
+            AwardEvent.objects.filter(id=self.object.id).update(certKey=key)
 
         context = super(AwardView, self).get_context_data(**kwargs)
 
         # Add image url to template context
-        context['certImg'] = settings.MEDIA_URL + str(self.object.id) + '.png'
-        context['certPDF'] = settings.MEDIA_URL + str(self.object.id) + '.pdf'
+        context['certImg'] = reverse('artifact', args=[img_name])
+        context['certPDF'] = reverse('artifact', args=[pdf_name])
         return context
+
+# Storage folders of certificate artifacts, all named by their content
+ARTIFACT_LOCATIONS = (CACHE_LOCATION + '/', CERT_THUMB_LOCATION + '/')
+
+# Seconds browsers and proxies may keep an artifact (one year)
+ARTIFACT_MAX_AGE = 365 * 24 * 60 * 60
+
+# Seconds browsers may reuse a redirect to an artifact's storage URL, well
+# within the lifetime of signed S3 URLs
+ARTIFACT_REDIRECT_MAX_AGE = 5 * 60
+
+class ArtifactView(View):
+    """ /teamiota/artifacts/<storage name>
+
+    Redirects to the artifact's storage URL, so storage serves the bytes
+    itself, with the Cache-Control settings.MEDIA_CACHE_CONTROL stored them
+    with and its own ETag and Last-Modified.
+    """
+
+    def get(self, request, name):
+        """ Answer a matching If-None-Match, else redirect to storage """
+
+        if not name.startswith(ARTIFACT_LOCATIONS) or '..' in name:
+            raise Http404
+
+        # Artifact names change with their content, so the name is a strong
+        # validator. A match is answered before any If-Modified-Since, and
+        # without storage access
+        etag = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in etags or '*' in etags:
+            response = HttpResponseNotModified()
+            response['ETag'] = quote_etag(etag)
+            patch_cache_control(
+                response, public=True, max_age=ARTIFACT_MAX_AGE,
+                immutable=True)
+            return response
+
+        # Signed URLs expire, so only the browser may keep the redirect
+        response = HttpResponseRedirect(storage.url(name))
+        patch_cache_control(
+            response, private=True, max_age=ARTIFACT_REDIRECT_MAX_AGE)
+        return response